@@ -5,17 +5,46 @@ from pathlib import Path
 import sqlite3
 import os
 import secrets
+import shutil
+import tempfile
 import subprocess
 from datetime import datetime
 from flask import (
-    Flask, render_template, request, jsonify, g, abort, url_for, session, send_from_directory
+    Flask, Request, Response, current_app, render_template, request, jsonify, g, abort, url_for, session,
+    send_from_directory, redirect
 )
+from flask.json.provider import DefaultJSONProvider
 from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import generate_password_hash, check_password_hash
+import hashlib
 import json
 import logging
+import mimetypes
+import atexit
+import collections
 import time
 import threading
+import sys
+import io
+import errno
+import fcntl
+import queue
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from functools import lru_cache
+
+try:
+    # optional: PyAV decodes thumbnails in-process instead of spawning ffmpeg
+    import av
+except ImportError:
+    av = None
+
+try:
+    # optional: C JSON encoder/decoder for jsonify, request.get_json and the heartbeat log
+    import orjson
+except ImportError:
+    orjson = None
 
 # --- basic logging ---
 logging.basicConfig(level=logging.INFO)
@@ -30,9 +59,47 @@ VIDEOS_DIR.mkdir(parents=True, exist_ok=True)
 THUMBS_DIR.mkdir(parents=True, exist_ok=True)
 SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
 
+SECRET_PATH = BASE_DIR / ".flask_secret"
+
+
+def _persistent_secret():
+    """
+    Session secret kept in .flask_secret (mode 600) so restarts don't log every admin out.
+    The key is written to a temp file first and hard-linked into place, so the file appears
+    complete or not at all: workers starting at the same time all end up with the same key.
+    """
+    try:
+        secret = SECRET_PATH.read_text(encoding="utf-8").strip()
+        if secret:
+            return secret
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning("could not read %s: %s", SECRET_PATH, e)
+    secret = secrets.token_urlsafe(32)
+    tmp = None
+    try:
+        fd, tmp = tempfile.mkstemp(dir=SECRET_PATH.parent, prefix=".flask_secret.")  # mode 600
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(secret)
+        os.link(tmp, SECRET_PATH)  # atomic, and fails if the file already exists
+    except FileExistsError:
+        # another process won the race; its file is already complete
+        return SECRET_PATH.read_text(encoding="utf-8").strip() or secret
+    except OSError as e:
+        logger.warning("could not persist session secret (sessions won't survive restarts): %s", e)
+    finally:
+        if tmp:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+    return secret
+
+
 app = Flask(__name__, static_folder="static", template_folder="templates")
 # set a secret key for sessions (in production set FLASK_SECRET env var)
-app.secret_key = os.environ.get("FLASK_SECRET") or secrets.token_urlsafe(32)
+app.secret_key = os.environ.get("FLASK_SECRET") or _persistent_secret()
 
 # Environment flags (customize via environment variables)
 # If you want uploaded video files to be committed into git, set GIT_COMMIT_MEDIA=1
@@ -56,53 +123,255 @@ GIT_BRANCH = os.environ.get("GIT_BRANCH", "main")
 
 # ----- upload limits (adjust as needed) -----
 app.config["MAX_CONTENT_LENGTH"] = 500 * 1024 * 1024
+# cap for non-file multipart fields held in memory; file parts always spool to temp files on disk
+app.config["MAX_FORM_MEMORY_SIZE"] = 1 * 1024 * 1024
+
+
+class AppRequest(Request):
+    """Request that honours MAX_FORM_MEMORY_SIZE (Flask < 3.1 does not read it from config)."""
+
+    @property
+    def max_form_memory_size(self):
+        return current_app.config.get("MAX_FORM_MEMORY_SIZE")
+
+
+app.request_class = AppRequest
+
+# Deployed behind a router / reverse proxy (Procfile), remote_addr would be the proxy's address
+# for every client. ProxyFix takes the client address from the X-Forwarded-For entry appended by
+# the last TRUSTED_PROXY_HOPS proxies; set TRUSTED_PROXY_HOPS=0 when clients connect directly
+# (the header is client-controlled then).
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", "1"))
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask's JSON provider with orjson doing the work. Keeps Flask's sorted keys and its
+    `default` handling (datetimes as HTTP dates, Decimal, __html__); anything orjson can't
+    take (extra json.dumps kwargs, unsupported types) goes through the stdlib provider.
+    """
+
+    def dumps(self, obj, **kwargs):
+        opts = {k: v for k, v in kwargs.items() if k not in ("indent", "separators")}
+        if not opts:
+            option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+            if self.sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            if kwargs.get("indent"):
+                option |= orjson.OPT_INDENT_2
+            try:
+                return orjson.dumps(obj, default=self.default, option=option).decode("utf-8")
+            except TypeError:  # orjson.JSONEncodeError subclasses TypeError
+                pass
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        # orjson.JSONDecodeError subclasses ValueError, which get_json() reports as a 400
+        return orjson.loads(s)
+
+
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+
+# Video delivery: when running behind nginx set VIDEO_ACCEL_PREFIX (e.g. "/_internal/videos/")
+# so /video/<id> hands the file to nginx (zero-copy sendfile) instead of streaming it through Python:
+#   location /_internal/videos/ { internal; alias /path/to/static/videos/;
+#       sendfile on; sendfile_max_chunk 512k; tcp_nopush on; }
+VIDEO_ACCEL_PREFIX = os.environ.get("VIDEO_ACCEL_PREFIX")
+# behind Apache (mod_xsendfile) / lighttpd, USE_X_SENDFILE=1 makes send_file emit an
+# X-Sendfile header and let the server stream the file instead of Python
+app.use_x_sendfile = os.environ.get("USE_X_SENDFILE", "0") == "1"
+# thumbnail filenames embed a random token, so they never change once written
+THUMB_CACHE_CONTROL = "public, max-age=31536000, immutable"
 
 # simple lock to serialize git operations and avoid races
 _git_lock = threading.Lock()
+# every gunicorn worker runs its own git-sync thread against the same working tree; this
+# flock serializes them across processes (git itself would fail on .git/index.lock)
+GIT_PROCESS_LOCK_PATH = BASE_DIR / ".git_sync.lock"
+
+
+@contextmanager
+def git_process_lock():
+    with open(GIT_PROCESS_LOCK_PATH, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)  # released when the file is closed
+        yield
+
+
+# one-time git setup (identity, remote, branch) done by this process; guarded by _git_lock
+_git_setup = {"remote": False, "branch": False}
+
+
+def _git_env():
+    """Environment for git subprocesses: identity comes from env vars, so no `git config` calls are needed."""
+    env = os.environ.copy()
+    name = GIT_AUTHOR_NAME or env.get("GIT_COMMITTER_NAME") or "auto-committer"
+    email = GIT_AUTHOR_EMAIL or env.get("GIT_COMMITTER_EMAIL") or "noreply@localhost"
+    env.update(GIT_AUTHOR_NAME=name, GIT_COMMITTER_NAME=name, GIT_AUTHOR_EMAIL=email, GIT_COMMITTER_EMAIL=email)
+    env["GIT_TERMINAL_PROMPT"] = "0"
+    return env
+
+
+GIT_ENV = _git_env()
 
 
 # ---------- helper: Snapshot DB to JSON files that are safe to commit ----------
-def snapshot_data_to_json(conn):
+# textual dump of the whole DB (written on manual push only); init_db restores from it when data.db is missing
+DB_DUMP_PATH = SNAPSHOT_DIR / "data.sql"
+# snapshot files are for diffs/restores, not reading: compact separators, streamed through a buffer
+SNAPSHOT_JSON_SEPARATORS = (",", ":")
+SNAPSHOT_WRITE_BUFFER = 1 << 16
+
+
+# plays is append-only (AUTOINCREMENT ids are never reused), so autosaves append only new rows
+# to plays.ndjson. The file itself is the cursor: every append re-reads its last id under an
+# flock, so several worker processes never write the same rows twice.
+PLAYS_NDJSON = SNAPSHOT_DIR / "plays.ndjson"
+
+
+# one long-lived connection for snapshots instead of connect/close per push (opened lazily)
+_snapshot_conn = None
+_snapshot_lock = threading.Lock()
+
+
+@contextmanager
+def snapshot_conn():
+    """Yield the shared snapshot connection, serialized by _snapshot_lock."""
+    global _snapshot_conn
+    with _snapshot_lock:
+        if _snapshot_conn is None:
+            _snapshot_conn = apply_pragmas(sqlite3.connect(DB_PATH, check_same_thread=False))
+            _snapshot_conn.row_factory = sqlite3.Row
+        yield _snapshot_conn
+
+
+def close_snapshot_conn():
+    global _snapshot_conn
+    with _snapshot_lock:
+        if _snapshot_conn is not None:
+            _snapshot_conn.close()
+            _snapshot_conn = None
+
+
+def write_json_rows(path, rows):
+    """
+    Write an iterable of dicts as a JSON array, one row at a time, into a buffered file:
+    neither the row list nor the whole JSON string is ever held in memory.
+    """
+    with open(path, "w", encoding="utf-8", buffering=SNAPSHOT_WRITE_BUFFER) as f:
+        f.write("[")
+        sep = ""
+        for row in rows:
+            f.write(sep)
+            f.write(json.dumps(row, default=str, separators=SNAPSHOT_JSON_SEPARATORS))
+            sep = ","
+        f.write("]")
+
+
+def _redact_user(u):
+    # password_hash is never selected; api keys are bearer credentials
+    if u["api_key"]:
+        u["api_key"] = "REDACTED"
+    return u
+
+
+def _last_ndjson_id(f):
+    """
+    id of the last complete record in an open, writable binary NDJSON file (0 if empty).
+    A torn last line (a crash mid-write) is truncated away so new records start on a fresh line.
+    """
+    start = max(0, f.seek(0, os.SEEK_END) - 4096)
+    f.seek(start)
+    tail = f.read()
+    if tail and not tail.endswith(b"\n"):
+        cut = tail.rfind(b"\n") + 1
+        f.truncate(start + cut)
+        tail = tail[:cut]
+    for line in reversed(tail.splitlines()):
+        try:
+            return int(json.loads(line)["id"])
+        except (ValueError, KeyError, TypeError):
+            continue
+    return 0
+
+
+def append_plays_ndjson(conn):
+    """Append plays newer than the file's last record to PLAYS_NDJSON, one JSON object per line."""
+    if not PLAYS_NDJSON.exists() and not conn.execute("SELECT 1 FROM plays LIMIT 1").fetchone():
+        return  # no file until the first play
+    with open(PLAYS_NDJSON, "a+b", buffering=SNAPSHOT_WRITE_BUFFER) as f:
+        # held until close: other workers wait, then see (and skip) what this one wrote
+        fcntl.flock(f, fcntl.LOCK_EX)
+        last = _last_ndjson_id(f)
+        (db_max,) = conn.execute("SELECT COALESCE(MAX(id), 0) FROM plays").fetchone()
+        if db_max == last:
+            return
+        if db_max < last:
+            # DB was replaced/reset underneath us: start the file over
+            f.truncate(0)
+            last = 0
+        cur = conn.execute("SELECT id,user_id,routine_id,played_at FROM plays WHERE id > ? ORDER BY id", (last,))
+        for row in cur:
+            f.write(json.dumps(dict(row), default=str, separators=SNAPSHOT_JSON_SEPARATORS).encode("utf-8"))
+            f.write(b"\n")
+
+
+def snapshot_data_to_json(conn, full=False):
     """
     Dump important tables to JSON files in data_snapshot/ and return list of file paths
     Redact sensitive fields (api_key, password_hash) before writing.
+
+    users/routines are small and mutable, so they are rewritten each time; plays only gets
+    its new rows appended to plays.ndjson. full=True (manual push) also rebuilds plays.json.
+    data.sql is rewritten every time: it is what a fresh checkout restores data.db from.
     """
     try:
         out_files = []
+        # sqlite3.Row -> dict is a single C-level pass per row (see snapshot_conn); rows are
+        # streamed from the cursor straight into the file, never collected into a list
         cur = conn.execute("SELECT id,username,age,country,occupation,admin,api_key,visits,reminders_set,last_seen,created_at FROM users ORDER BY id")
-        users_raw = [dict(zip([c[0] for c in cur.description], row)) for row in cur.fetchall()]
-        users = []
-        for u in users_raw:
-            safe = dict(u)
-            # redact sensitive fields
-            if safe.get("api_key"):
-                safe["api_key"] = "REDACTED"
-            if "password_hash" in safe:
-                safe.pop("password_hash", None)
-            users.append(safe)
-
         ufile = SNAPSHOT_DIR / "users.json"
-        ufile.write_text(json.dumps(users, default=str, indent=2), encoding="utf-8")
+        write_json_rows(ufile, (_redact_user(dict(row)) for row in cur))
         out_files.append(str(ufile.relative_to(BASE_DIR)))
 
         cur = conn.execute(
             "SELECT id,title,category,difficulty,duration,video_url,thumbnail_url,description,uploaded_by,uploaded_at,views FROM routines ORDER BY id"
         )
-        routines = [dict(zip([c[0] for c in cur.description], row)) for row in cur.fetchall()]
         rfile = SNAPSHOT_DIR / "routines.json"
-        rfile.write_text(json.dumps(routines, default=str, indent=2), encoding="utf-8")
+        write_json_rows(rfile, map(dict, cur))
         out_files.append(str(rfile.relative_to(BASE_DIR)))
 
-        cur = conn.execute("SELECT id,user_id,routine_id,played_at FROM plays ORDER BY id")
-        plays = [dict(zip([c[0] for c in cur.description], row)) for row in cur.fetchall()]
-        pfile = SNAPSHOT_DIR / "plays.json"
-        pfile.write_text(json.dumps(plays, default=str, indent=2), encoding="utf-8")
-        out_files.append(str(pfile.relative_to(BASE_DIR)))
-
-        # Optionally snapshot the DB file itself (NOTE: this commits a binary sqlite DB)
-        dbfile = DB_PATH
-        if dbfile.exists():
-            out_files.append(str(dbfile.relative_to(BASE_DIR)))
+        append_plays_ndjson(conn)
+        if PLAYS_NDJSON.exists():  # not created until the first play; a missing pathspec fails the whole `git add`
+            out_files.append(str(PLAYS_NDJSON.relative_to(BASE_DIR)))
+
+        if full:
+            cur = conn.execute("SELECT id,user_id,routine_id,played_at FROM plays ORDER BY id")
+            pfile = SNAPSHOT_DIR / "plays.json"
+            write_json_rows(pfile, map(dict, cur))
+            out_files.append(str(pfile.relative_to(BASE_DIR)))
+
+        # SQL text instead of the binary data.db: git can delta-compress and diff it.
+        # Dumped from an in-memory copy with the credentials cleared, like users.json
+        # (NULL, not a placeholder: a restored api_key must not be a usable admin key).
+        # A restored admin therefore has no credentials; admin_exists() ignores such rows
+        # so /api/admin/register can reclaim the account.
+        mem = sqlite3.connect(":memory:")
+        try:
+            conn.backup(mem)
+            mem.execute("UPDATE users SET password_hash = NULL, api_key = NULL")
+            mem.commit()
+            with open(DB_DUMP_PATH, "w", encoding="utf-8", buffering=SNAPSHOT_WRITE_BUFFER) as f:
+                for line in mem.iterdump():
+                    f.write(line)
+                    f.write("\n")
+        finally:
+            mem.close()
+        out_files.append(str(DB_DUMP_PATH.relative_to(BASE_DIR)))
 
         return out_files
     except Exception as e:
@@ -127,7 +396,16 @@ def mask_token_url(url):
         return "<masked_url>"
 
 
+def git_text(b):
+    """Decode git output bytes for logging/inspection (run_git_cmd leaves them raw)."""
+    return b.decode("utf-8", errors="replace").strip() if b else ""
+
+
 def run_git_cmd(args, timeout=GIT_TIMEOUT, env=None):
+    """
+    Run git in BASE_DIR and return (returncode, stdout, stderr) with stdout/stderr as raw
+    bytes: most callers only look at the return code, so decoding waits for git_text().
+    """
     try:
         # mask any URL-looking arg for logs
         safe_args = []
@@ -138,29 +416,14 @@ def run_git_cmd(args, timeout=GIT_TIMEOUT, env=None):
                 safe_args.append(a)
         logger.info("git %s", " ".join(safe_args))
 
-        r = subprocess.run(["git"] + args, cwd=str(BASE_DIR), stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout, env=env)
-        out = r.stdout.decode("utf-8", errors="replace").strip()
-        err = r.stderr.decode("utf-8", errors="replace").strip()
-        return r.returncode, out, err
+        r = subprocess.run(["git"] + args, cwd=str(BASE_DIR), stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout, env=env or GIT_ENV)
+        return r.returncode, r.stdout, r.stderr
     except subprocess.TimeoutExpired:
-        return 1, "", "git command timed out"
+        return 1, b"", b"git command timed out"
     except FileNotFoundError:
-        return 1, "", "git not installed"
+        return 1, b"", b"git not installed"
     except Exception as e:
-        return 1, "", str(e)
-
-
-def ensure_git_identity():
-    """
-    Ensure local repo has user.name and user.email configured (local config).
-    Use GIT_AUTHOR_NAME and GIT_AUTHOR_EMAIL env vars when present.
-    """
-    name = GIT_AUTHOR_NAME or os.environ.get("GIT_COMMITTER_NAME") or "auto-committer"
-    email = GIT_AUTHOR_EMAIL or os.environ.get("GIT_COMMITTER_EMAIL") or "noreply@localhost"
-    # set repo-local config (won't affect global)
-    run_git_cmd(["config", "user.name", name])
-    run_git_cmd(["config", "user.email", email])
-    logger.info("git identity set: %s <%s>", name, email)
+        return 1, b"", str(e).encode("utf-8", errors="replace")
 
 
 def ensure_remote_configured():
@@ -175,7 +438,7 @@ def ensure_remote_configured():
 
     rc, out, err = run_git_cmd(["remote", "get-url", GITHUB_REMOTE_NAME])
     if rc == 0:
-        if out.strip() == GITHUB_REPO_URL.strip():
+        if git_text(out) == GITHUB_REPO_URL.strip():
             logger.info("Remote %s already configured", GITHUB_REMOTE_NAME)
             return True
         else:
@@ -185,7 +448,7 @@ def ensure_remote_configured():
                 logger.info("Remote %s url updated", GITHUB_REMOTE_NAME)
                 return True
             else:
-                logger.warning("Failed to set remote url: %s", e2 or o2)
+                logger.warning("Failed to set remote url: %s", git_text(e2 or o2))
                 return False
     else:
         # add remote, careful with logging
@@ -194,7 +457,7 @@ def ensure_remote_configured():
             logger.info("Remote %s added", GITHUB_REMOTE_NAME)
             return True
         else:
-            logger.warning("Failed to add remote: %s", e2 or o2)
+            logger.warning("Failed to add remote: %s", git_text(e2 or o2))
             return False
 
 
@@ -207,20 +470,20 @@ def ensure_branch_for_push(branch_name):
     """
     try:
         rc, out, err = run_git_cmd(["rev-parse", "--abbrev-ref", "HEAD"])
-        cur = (out or "").strip()
+        cur = git_text(out)
         if rc != 0:
-            return False, f"rev-parse failed: {err or out}"
+            return False, f"rev-parse failed: {git_text(err or out)}"
 
         if cur == "HEAD" or not cur:
             # create or reset branch to current HEAD (safe operation)
             rc2, o2, e2 = run_git_cmd(["branch", "-f", branch_name, "HEAD"])  # force-create/point branch to HEAD
             if rc2 != 0:
-                return False, f"could not create branch {branch_name}: {e2 or o2}"
+                return False, f"could not create branch {branch_name}: {git_text(e2 or o2)}"
             # checkout the branch so subsequent commits are on-named-branch
             rc3, o3, e3 = run_git_cmd(["checkout", branch_name])
             if rc3 != 0:
                 # fallback: we didn't change working HEAD; still okay if we push HEAD:branch explicitly
-                return False, f"checkout failed: {e3 or o3}"
+                return False, f"checkout failed: {git_text(e3 or o3)}"
             return True, f"created+checked-out branch {branch_name}"
         else:
             return True, f"on branch {cur}"
@@ -228,10 +491,10 @@ def ensure_branch_for_push(branch_name):
         return False, str(e)
 
 
-def push_to_git(paths=None, message=None, include_media=False):
+def push_to_git(paths=None, message=None, include_media=False, full_snapshot=False):
     """
     paths: list of relative paths (strings) to add to git. If None the function will snapshot the DB
-    and add the snapshot files (and DB if present).
+    and add the snapshot files; full_snapshot also rebuilds plays.json and the data.sql dump.
 
     This function is best-effort: it logs errors but doesn't raise so app requests won't fail
     if git is unavailable or push fails.
@@ -240,22 +503,22 @@ def push_to_git(paths=None, message=None, include_media=False):
         logger.info("GIT_SYNC disabled via env; skipping git push")
         return False
 
-    with _git_lock:
+    with _git_lock, git_process_lock():
         # Initialize git if missing and GITHUB_REPO_URL is set
         if not git_repo_present():
             logger.info(".git not present. Initializing git repository.")
             rc, out, err = run_git_cmd(["init"])  # may be detached initial commit depending on environment
             if rc != 0:
-                logger.warning("git init failed: %s", err or out)
+                logger.warning("git init failed: %s", git_text(err or out))
             # ensure remote if URL provided
             if GITHUB_REPO_URL:
                 rc2, o2, e2 = run_git_cmd(["remote", "add", GITHUB_REMOTE_NAME, GITHUB_REPO_URL])
                 if rc2 != 0:
-                    logger.warning("git remote add failed: %s", e2 or o2)
+                    logger.warning("git remote add failed: %s", git_text(e2 or o2))
 
-        # If remote not configured, try to configure it
-        if GITHUB_REPO_URL:
-            ensure_remote_configured()
+        # If remote not configured, try to configure it (once per process)
+        if GITHUB_REPO_URL and not _git_setup["remote"]:
+            _git_setup["remote"] = ensure_remote_configured()
 
         if not git_repo_present():
             logger.info("No .git repo found under %s — skipping git operations", BASE_DIR)
@@ -264,9 +527,8 @@ def push_to_git(paths=None, message=None, include_media=False):
         # Create snapshot paths if not provided
         if paths is None:
             try:
-                conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES)
-                paths = snapshot_data_to_json(conn)
-                conn.close()
+                with snapshot_conn() as conn:
+                    paths = snapshot_data_to_json(conn, full=full_snapshot)
             except Exception as e:
                 logger.exception("could not snapshot DB for git push: %s", e)
                 paths = []
@@ -282,58 +544,51 @@ def push_to_git(paths=None, message=None, include_media=False):
             return True
 
         try:
-            # ensure local git identity exists
-            ensure_git_identity()
-
-            # attempt to ensure we're on a branch for pushing
-            ok_branch, branch_info = ensure_branch_for_push(GIT_BRANCH)
-            logger.info("ensure_branch_for_push: %s (%s)", ok_branch, branch_info)
+            # attempt to ensure we're on a branch for pushing; only our own commits move HEAD
+            # afterwards, so once we're on a branch there is no need to re-check every push
+            if not _git_setup["branch"]:
+                ok_branch, branch_info = ensure_branch_for_push(GIT_BRANCH)
+                logger.info("ensure_branch_for_push: %s (%s)", ok_branch, branch_info)
+                _git_setup["branch"] = ok_branch
 
             # run git add for each path
             add_args = ["add", "--"] + paths
             rc, out, err = run_git_cmd(add_args)
             if rc != 0:
-                logger.warning("git add returned non-zero: %s", err or out)
-
-            # check for staged changes
-            rc, status_out, status_err = run_git_cmd(["status", "--porcelain"]) 
-            if rc != 0:
-                logger.warning("git status failed: %s", status_err or status_out)
+                logger.warning("git add returned non-zero: %s", git_text(err or out))
 
-            if not status_out.strip():
+            # check for staged changes (exit 0 = nothing staged, 1 = changes); unlike
+            # `status --porcelain` this never walks the untracked working tree
+            rc, diff_out, diff_err = run_git_cmd(["diff", "--cached", "--quiet"])
+            if rc == 0:
                 logger.info("no changes to commit")
                 return True
+            if rc != 1:
+                logger.warning("git diff --cached failed: %s", git_text(diff_err or diff_out))
 
             # commit
             commit_message = message or f"autosave: snapshot {datetime.utcnow().isoformat()}"
-            # also set GIT_AUTHOR_* env values for subprocess commit if provided
-            env = os.environ.copy()
-            if GIT_AUTHOR_NAME:
-                env["GIT_AUTHOR_NAME"] = GIT_AUTHOR_NAME
-                env["GIT_COMMITTER_NAME"] = GIT_AUTHOR_NAME
-            if GIT_AUTHOR_EMAIL:
-                env["GIT_AUTHOR_EMAIL"] = GIT_AUTHOR_EMAIL
-                env["GIT_COMMITTER_EMAIL"] = GIT_AUTHOR_EMAIL
+            # identity comes from GIT_ENV (GIT_AUTHOR_* / GIT_COMMITTER_*)
+            env = GIT_ENV
 
             logger.info("Committing with message: %s", commit_message)
-            p = subprocess.run(["git", "commit", "-m", commit_message], cwd=str(BASE_DIR), stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, timeout=GIT_TIMEOUT)
-            pout = p.stdout.decode("utf-8", errors="replace").strip()
-            perr = p.stderr.decode("utf-8", errors="replace").strip()
-            if p.returncode != 0:
-                logger.warning("git commit failed (non-fatal): %s", perr or pout)
+            rc_c, pout, perr = run_git_cmd(["commit", "-m", commit_message], env=env)
+            if rc_c != 0:
+                logger.warning("git commit failed (non-fatal): %s", git_text(perr or pout))
                 # continue anyway to attempt push
 
-            # If remote exists, push to the configured branch
-            rc_remote, remote_out, remote_err = run_git_cmd(["remote", "get-url", GITHUB_REMOTE_NAME])
-            if rc_remote != 0:
-                logger.warning("No configured remote '%s' - cannot push", GITHUB_REMOTE_NAME)
-                return False
+            # If remote exists, push to the configured branch (skip the check once we configured it ourselves)
+            if not _git_setup["remote"]:
+                rc_remote, remote_out, remote_err = run_git_cmd(["remote", "get-url", GITHUB_REMOTE_NAME])
+                if rc_remote != 0:
+                    logger.warning("No configured remote '%s' - cannot push", GITHUB_REMOTE_NAME)
+                    return False
 
             # attempt push with upstream set (push -u origin <branch>), but if detached HEAD persists use HEAD:refs/heads/<branch>
             push_args = ["push", GITHUB_REMOTE_NAME, f"{GIT_BRANCH}", "--set-upstream"]
             rc_push, out_push, err_push = run_git_cmd(push_args, timeout=GIT_TIMEOUT * 2, env=env)
             if rc_push != 0:
-                logger.warning("git push --set-upstream failed: %s", err_push or out_push)
+                logger.warning("git push --set-upstream failed: %s", git_text(err_push or out_push))
                 # fallback: try pushing HEAD explicitly to remote branch (handles detached HEAD)
                 fallback_args = ["push", GITHUB_REMOTE_NAME, f"HEAD:refs/heads/{GIT_BRANCH}"]
                 rc_fb, out_fb, err_fb = run_git_cmd(fallback_args, timeout=GIT_TIMEOUT * 4, env=env)
@@ -341,16 +596,16 @@ def push_to_git(paths=None, message=None, include_media=False):
                     # final fallback: plain git push
                     rc2, out2, err2 = run_git_cmd(["push"], timeout=GIT_TIMEOUT * 2, env=env)
                     if rc2 != 0:
-                        logger.warning("git push final fallback failed: %s", err2 or out2)
+                        logger.warning("git push final fallback failed: %s", git_text(err2 or out2))
                         return False
                     else:
-                        logger.info("git push OK (final fallback): %s", out2)
+                        logger.info("git push OK (final fallback): %s", git_text(out2))
                         return True
                 else:
-                    logger.info("git push OK (fallback HEAD:branch): %s", out_fb)
+                    logger.info("git push OK (fallback HEAD:branch): %s", git_text(out_fb))
                     return True
             else:
-                logger.info("git push OK: %s", out_push)
+                logger.info("git push OK: %s", git_text(out_push))
                 return True
 
         except Exception as e:
@@ -358,10 +613,125 @@ def push_to_git(paths=None, message=None, include_media=False):
             return False
 
 
+# ---------- background git sync ----------
+# Handlers only enqueue (message, include_media); a single worker thread drains the
+# queue, waits GIT_DEBOUNCE_SEC for the burst to settle (and at least PUSH_INTERVAL_SEC
+# since the previous push), and runs push_to_git once for everything collected.
+# A non-empty queue is the "dirty" flag. /api/admin/git_push stays synchronous.
+GIT_DEBOUNCE_SEC = float(os.environ.get("GIT_DEBOUNCE_SEC", "2"))
+PUSH_INTERVAL_SEC = float(os.environ.get("PUSH_INTERVAL_SEC", "30"))
+# commit message lists at most this many of the coalesced messages
+GIT_MESSAGE_MAX_PARTS = 10
+_git_queue = queue.Queue()
+_last_push_ts = float("-inf")
+# set at shutdown: the worker stops waiting and leaves what's pending to flush_git_queue
+_git_stop = threading.Event()
+_git_worker = None
+
+
+def _drain_git_queue(first=None):
+    """Collapse everything pending into one (message, include_media), or None if empty."""
+    items = [] if first is None else [first]
+    while True:
+        try:
+            items.append(_git_queue.get_nowait())
+        except queue.Empty:
+            break
+    if not items:
+        return None
+    # identical messages (e.g. repeated activity flushes) are listed once, in first-seen order
+    parts = list(dict.fromkeys(msg for msg, _ in items))
+    message = "; ".join(parts[:GIT_MESSAGE_MAX_PARTS])
+    if len(parts) > GIT_MESSAGE_MAX_PARTS:
+        message += f" (+{len(parts) - GIT_MESSAGE_MAX_PARTS} more)"
+    return message, any(media for _, media in items)
+
+
+def _git_worker_loop():
+    global _last_push_ts
+    while not _git_stop.is_set():
+        try:
+            first = _git_queue.get(timeout=1)
+        except queue.Empty:
+            continue
+        if _git_stop.wait(max(GIT_DEBOUNCE_SEC, _last_push_ts + PUSH_INTERVAL_SEC - time.monotonic())):
+            _git_queue.put(first)  # shutting down: flush_git_queue pushes it
+            return
+        message, include_media = _drain_git_queue(first)
+        try:
+            push_to_git(paths=None, message=message, include_media=include_media)
+        except Exception:
+            logger.exception("background git push failed")
+        _last_push_ts = time.monotonic()
+
+
+def flush_git_queue():
+    """Stop the worker and push anything still queued (used at shutdown)."""
+    _git_stop.set()
+    worker = _git_worker
+    if worker is not None and worker.is_alive() and worker is not threading.current_thread():
+        # let an in-flight push finish (or the worker hand back its pending item) first
+        worker.join(timeout=GIT_TIMEOUT * 8)
+    pending = _drain_git_queue()
+    if pending:
+        try:
+            push_to_git(paths=None, message=pending[0], include_media=pending[1])
+        except Exception:
+            logger.exception("git push failed during shutdown flush")
+
+
+# atexit runs LIFO: the snapshot connection is closed after the final git flush has used it
+atexit.register(close_snapshot_conn)
+atexit.register(flush_git_queue)
+
+
+# ---------- SQLite connection tuning ----------
+# journal_mode=WAL is persistent in the DB file (set once in init_db); the rest are per-connection settings.
+SQLITE_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",  # 64 MiB page cache
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA wal_autocheckpoint=1000",
+)
+# how often the background thread runs PRAGMA optimize (seconds)
+SQLITE_OPTIMIZE_INTERVAL = 15 * 60
+
+
+def apply_pragmas(conn):
+    """Apply the per-connection PRAGMAs (WAL-friendly durability, bigger cache, busy wait)."""
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _optimize_loop():
+    """Periodically let SQLite refresh planner statistics (PRAGMA optimize)."""
+    while True:
+        time.sleep(SQLITE_OPTIMIZE_INTERVAL)
+        try:
+            conn = sqlite3.connect(DB_PATH)
+            apply_pragmas(conn)
+            conn.execute("PRAGMA optimize")
+            conn.close()
+        except Exception as e:
+            logger.info("PRAGMA optimize failed: %s", e)
+
+
 # ---------- DB initialization + safe migrations (unchanged) ----------
 def init_db():
-    conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES)
+    restore = not DB_PATH.exists() and DB_DUMP_PATH.exists()
+    # autocommit mode: the schema work below is one explicit transaction (one fsync) instead
+    # of the implicit per-statement commits sqlite3 does for DDL
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    if restore:
+        logger.info("data.db missing; restoring from %s", DB_DUMP_PATH)
+        conn.executescript(DB_DUMP_PATH.read_text(encoding="utf-8"))
+    conn.execute("PRAGMA journal_mode=WAL")
+    apply_pragmas(conn)
     c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
 
     # create base tables (password_hash may be added later)
     c.execute(
@@ -412,14 +782,11 @@ def init_db():
         """
     )
 
-    conn.commit()
-
     # safe migration: add password_hash column if missing (for admin username+password)
     cols = [r[1] for r in conn.execute("PRAGMA table_info(users)").fetchall()]
     if "password_hash" not in cols:
         try:
             conn.execute("ALTER TABLE users ADD COLUMN password_hash TEXT")
-            conn.commit()
         except Exception as e:
             logger.info("Could not add password_hash column: %s", e)
 
@@ -428,38 +795,93 @@ def init_db():
     if "thumbnail_url" not in rcols:
         try:
             conn.execute("ALTER TABLE routines ADD COLUMN thumbnail_url TEXT")
-            conn.commit()
         except Exception as e:
             logger.info("Could not add thumbnail_url column: %s", e)
 
-    # Deduplicate legacy duplicates (if any): aggregate visits, reminders, keep earliest created
+    # Deduplicate legacy duplicates (if any): aggregate visits, reminders, keep earliest created.
+    # Done entirely in SQL: fold each group's totals into its lowest id, then drop the rest,
+    # under a savepoint so a failure undoes both. The UNIQUE(username, country) index makes the
+    # existence probe cheap, so the usual no-duplicates startup skips both statements.
     try:
-        cur = conn.execute(
-            "SELECT username, country, COUNT(1) as cnt FROM users GROUP BY username, country HAVING cnt > 1"
-        )
-        groups = cur.fetchall()
-        for (username, country, cnt) in groups:
-            rows = list(
-                conn.execute(
-                    "SELECT id, visits, reminders_set, created_at FROM users WHERE username = ? AND country = ? ORDER BY created_at ASC",
-                    (username, country),
-                )
-            )
-            if len(rows) <= 1:
-                continue
-            keep_id = rows[0][0]
-            total_visits = sum(r[1] or 0 for r in rows)
-            any_reminders = 1 if any((r[2] or 0) for r in rows) else 0
-            earliest_created = rows[0][3]
+        has_dupes = conn.execute(
+            "SELECT 1 FROM users GROUP BY username, country HAVING COUNT(*) > 1 LIMIT 1"
+        ).fetchone()
+    except Exception as e:
+        logger.info("dedupe check error: %s", e)
+        has_dupes = None
+    if has_dupes:
+        conn.execute("SAVEPOINT dedupe")
+        try:
             conn.execute(
-                "UPDATE users SET visits = ?, reminders_set = ?, created_at = ? WHERE id = ?",
-                (total_visits, any_reminders, earliest_created, keep_id),
+                """
+                WITH keep AS (
+                    SELECT MIN(id) AS keep_id,
+                           SUM(COALESCE(visits, 0)) AS v,
+                           MAX(COALESCE(reminders_set, 0)) AS r,
+                           MIN(created_at) AS c
+                    FROM users
+                    GROUP BY username, country
+                    HAVING COUNT(*) > 1
+                )
+                UPDATE users SET
+                    visits = (SELECT v FROM keep WHERE keep.keep_id = users.id),
+                    reminders_set = (SELECT r FROM keep WHERE keep.keep_id = users.id),
+                    created_at = (SELECT c FROM keep WHERE keep.keep_id = users.id)
+                WHERE id IN (SELECT keep_id FROM keep)
+                """
             )
-            other_ids = [r[0] for r in rows[1:]]
-            conn.executemany("DELETE FROM users WHERE id = ?", [(i,) for i in other_ids])
-        conn.commit()
+            conn.execute("DELETE FROM users WHERE id NOT IN (SELECT MIN(id) FROM users GROUP BY username, country)")
+            conn.execute("RELEASE dedupe")
+        except Exception as e:
+            logger.info("dedupe error: %s", e)
+            conn.execute("ROLLBACK TO dedupe")
+            conn.execute("RELEASE dedupe")
+
+    # running totals for the admin metrics, kept by triggers so SUM(visits)/SUM(views)
+    # never scan the tables; seeded once from the current sums when first created
+    conn.execute("CREATE TABLE IF NOT EXISTS counters (k TEXT PRIMARY KEY, v INTEGER NOT NULL DEFAULT 0)")
+    for key, table, col in (("visits_total", "users", "visits"), ("views_total", "routines", "views")):
+        conn.execute(
+            f"INSERT OR IGNORE INTO counters (k, v) VALUES ('{key}', (SELECT COALESCE(SUM({col}), 0) FROM {table}))"
+        )
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{col}_ins AFTER INSERT ON {table} BEGIN
+                UPDATE counters SET v = v + COALESCE(NEW.{col}, 0) WHERE k = '{key}';
+            END
+            """
+        )
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{col}_upd AFTER UPDATE OF {col} ON {table} BEGIN
+                UPDATE counters SET v = v + COALESCE(NEW.{col}, 0) - COALESCE(OLD.{col}, 0) WHERE k = '{key}';
+            END
+            """
+        )
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{col}_del AFTER DELETE ON {table} BEGIN
+                UPDATE counters SET v = v - COALESCE(OLD.{col}, 0) WHERE k = '{key}';
+            END
+            """
+        )
+
+    # indexes for the hot lookups / ORDER BY paths (UNIQUE(username,country) already has one)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_routines_uploaded_at ON routines(uploaded_at DESC)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_plays_user_routine ON plays(user_id, routine_id)")
+    # plays by user are served by idx_plays_user_routine's leading column; this covers per-routine lookups
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_plays_routine ON plays(routine_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_admin ON users(admin) WHERE admin = 1")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_apikey ON users(api_key) WHERE api_key IS NOT NULL")
+    # partial index: the metrics COUNT(reminders_set = 1) reads only the opted-in rows
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_reminders_set ON users(reminders_set) WHERE reminders_set = 1")
+    conn.execute("ANALYZE")
+    conn.execute("COMMIT")
+
+    try:
+        conn.execute("PRAGMA optimize")
     except Exception as e:
-        logger.info("dedupe error: %s", e)
+        logger.info("PRAGMA optimize failed: %s", e)
 
     conn.close()
 
@@ -467,44 +889,214 @@ def init_db():
 init_db()
 
 
+# ---------- SQL used on hot paths ----------
+# Kept as module constants so every call passes the identical string and hits
+# sqlite3's per-connection statement cache.
+# only admins that can still sign in: rows restored from data.sql have no credentials
+SQL_COUNT_ADMINS = (
+    "SELECT COUNT(1) AS cnt FROM users "
+    "WHERE admin = 1 AND (password_hash IS NOT NULL OR api_key IS NOT NULL)"
+)
+SQL_SELECT_ADMIN_BY_ID = "SELECT * FROM users WHERE id = ? AND admin = 1"
+SQL_SELECT_ADMIN_BY_KEY = "SELECT * FROM users WHERE api_key = ? AND admin = 1"
+# register-or-touch: touch the existing row, insert only when the UPDATE matched nothing.
+# (An INSERT ... ON CONFLICT DO UPDATE upsert would consume an AUTOINCREMENT id on every
+# re-register, and whether it inserted can't be told reliably from the returned row.)
+SQL_TOUCH_USER = (
+    "UPDATE users SET age = ?, occupation = ?, last_seen = CURRENT_TIMESTAMP, visits = visits + 1 "
+    "WHERE username = ? AND country = ? RETURNING *"
+)
+SQL_INSERT_USER = (
+    "INSERT INTO users (username, age, country, occupation, admin, api_key, visits, last_seen) "
+    "VALUES (?,?,?,?,0,NULL,1,CURRENT_TIMESTAMP) RETURNING *"
+)
+SQL_SELECT_USER_ID_BY_UC = "SELECT id FROM users WHERE username = ? AND country = ?"
+SQL_ADD_VISITS = "UPDATE users SET visits = visits + ?, last_seen = CURRENT_TIMESTAMP WHERE username = ? AND country = ?"
+SQL_ADD_ROUTINE_VIEWS = "UPDATE routines SET views = views + ? WHERE id = ?"
+SQL_INSERT_PLAY = "INSERT INTO plays (user_id, routine_id) VALUES (?,?)"
+SQL_INSERT_ROUTINE = (
+    "INSERT INTO routines (title,category,difficulty,duration,video_url,thumbnail_url,description,uploaded_by) "
+    "VALUES (?,?,?,?,?,?,?,?)"
+)
+# admin delete/replace only need these columns, not the whole row
+SQL_SELECT_ROUTINE_FILES = "SELECT video_url, thumbnail_url FROM routines WHERE id = ?"
+SQL_SELECT_ROUTINE_TEXT = "SELECT title, description FROM routines WHERE id = ?"
+# delete and get back the files to unlink in one statement
+SQL_DELETE_ROUTINE = "DELETE FROM routines WHERE id = ? RETURNING video_url, thumbnail_url"
+
+
+def json_array_sql(cols, from_sql):
+    """
+    SELECT that has SQLite (JSON1) build the whole JSON array itself: one json_object per row
+    of the ordered inner query, returned as a single string ('[]' when there are no rows).
+    """
+    obj = ",".join(f"'{c}',{c}" for c in cols)
+    return f"SELECT json_group_array(json_object({obj})) FROM (SELECT {','.join(cols)} {from_sql})"
+
+
+SQL_ROUTINES_JSON = json_array_sql(
+    ("id", "title", "category", "difficulty", "duration", "video_url", "thumbnail_url", "description", "uploaded_at", "views"),
+    "FROM routines ORDER BY uploaded_at DESC",
+)
+SQL_ADMIN_USERS_JSON = json_array_sql(
+    ("id", "username", "age", "country", "occupation", "admin", "visits", "reminders_set", "last_seen", "created_at"),
+    "FROM users ORDER BY created_at DESC",
+)
+SQL_ROUTINES_VERSION = "SELECT MAX(uploaded_at), COUNT(*) FROM routines"
+# Timestamps are produced by SQLite (CURRENT_TIMESTAMP) and read back as plain
+# strings: no Python datetime adapters on write, no PARSE_DECLTYPES parsing on read.
+# larger per-connection prepared statement cache (sqlite3 default is 128)
+SQL_CACHED_STATEMENTS = 256
+
+
 # ---------- DB helpers ----------
-def get_db():
-    db = getattr(g, "_db", None)
+# One long-lived writer connection (serialized by WRITER_LOCK) and per-request
+# read-only connections, so reads never queue behind writes under WAL.
+def open_writer_conn():
+    conn = sqlite3.connect(
+        DB_PATH,
+        check_same_thread=False,
+        isolation_level=None,
+        cached_statements=SQL_CACHED_STATEMENTS,
+    )
+    apply_pragmas(conn)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+# opened by init_worker_process() in the process that uses it, never at import: under
+# gunicorn's preload_app the module is imported in the master and a SQLite connection
+# must not cross fork
+WRITER_CONN = None
+WRITER_LOCK = threading.Lock()
+
+
+@contextmanager
+def write_db():
+    """
+    Hold WRITER_LOCK and yield WRITER_CONN inside one BEGIN IMMEDIATE ... COMMIT
+    transaction (rolled back if the block raises).
+    """
+    ensure_worker_process()
+    with WRITER_LOCK:
+        WRITER_CONN.execute("BEGIN IMMEDIATE")
+        try:
+            yield WRITER_CONN
+        except BaseException:
+            WRITER_CONN.execute("ROLLBACK")
+            raise
+        WRITER_CONN.execute("COMMIT")
+
+
+def get_read_db():
+    db = getattr(g, "_read_db", None)
     if db is None:
-        db = g._db = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES)
+        db = g._read_db = sqlite3.connect(
+            f"{DB_PATH.resolve().as_uri()}?mode=ro",
+            uri=True,
+            cached_statements=SQL_CACHED_STATEMENTS,
+        )
+        apply_pragmas(db)
         db.row_factory = sqlite3.Row
     return db
 
 
 @app.teardown_appcontext
 def close_db(exc):
-    db = getattr(g, "_db", None)
+    db = getattr(g, "_read_db", None)
     if db is not None:
         db.close()
 
 
 def row_to_dict(r):
     """Convert sqlite3.Row to plain dict (safe)."""
-    if r is None:
-        return None
-    return dict(zip(r.keys(), [r[k] for k in r.keys()]))
+    return None if r is None else dict(r)
+
+
+def json_rows_response(db, sql, params=()):
+    """Return the single JSON text value produced by a json_array_sql() query as the response body."""
+    (body,) = db.execute(sql, params).fetchone()
+    return Response(body, mimetype="application/json")
+
+
+# ---------- cached routines list (/api/routines, /api/admin/videos) ----------
+# The catalog only changes on admin writes, so the serialized JSON is kept until
+# the (MAX(uploaded_at), COUNT(*)) version changes or a write path invalidates it.
+# View counters (batched play flushes, other workers' writes) don't move the version,
+# so an entry is also rebuilt once it is ROUTINES_CACHE_TTL seconds old.
+ROUTINES_CACHE_TTL = 5
+# "entry" is (version_key, built_at, body, etag), swapped as one tuple so readers never mix entries
+_ROUTINES_CACHE = {"entry": None}
+
+
+def invalidate_routines_cache():
+    _ROUTINES_CACHE["entry"] = None
+
+
+def routines_json(db):
+    """Return (body, etag) for the routines list, from cache when still valid."""
+    now = time.monotonic()
+    key = tuple(db.execute(SQL_ROUTINES_VERSION).fetchone())
+    entry = _ROUTINES_CACHE["entry"]
+    if entry is None or entry[0] != key or now - entry[1] >= ROUTINES_CACHE_TTL:
+        # SQLite builds the JSON text itself; no per-row dicts or re-serialization in Python
+        (body,) = db.execute(SQL_ROUTINES_JSON).fetchone()
+        entry = (key, now, body, hashlib.sha1(body.encode("utf-8")).hexdigest())
+        _ROUTINES_CACHE["entry"] = entry
+    return entry[2], entry[3]
 
 
 # ---------- thumbnail helper ----------
+THUMB_WIDTH = 320
+
+
+def _thumbnail_pyav(video_path: Path, thumb_path: Path):
+    """Grab the first keyframe at/after 1 second with PyAV and save a 320px-wide JPEG."""
+    with av.open(str(video_path)) as container:
+        stream = container.streams.video[0]
+        stream.codec_context.skip_frame = "NONKEY"
+        # without a stream argument the offset is in av.time_base units (microseconds)
+        container.seek(av.time_base)
+        frame = next(container.decode(stream), None)
+        if frame is None:
+            # clip shorter than the seek target: take the first keyframe instead
+            container.seek(0)
+            frame = next(container.decode(stream))
+        # scale in libswscale while converting to RGB, rather than converting the
+        # full-resolution frame and shrinking it afterwards in Pillow
+        kwargs = {}
+        if frame.width > THUMB_WIDTH:
+            kwargs = {"width": THUMB_WIDTH, "height": max(2, round(frame.height * THUMB_WIDTH / frame.width / 2) * 2)}
+        img = frame.to_image(**kwargs)
+    img.save(thumb_path, "JPEG", quality=80)
+    return thumb_path.exists()
+
+
 def generate_thumbnail(video_path: Path, thumb_path: Path):
     """
     Generate a JPEG thumbnail for video_path and save to thumb_path.
-    Uses ffmpeg if available. Returns True if thumbnail created.
+    Uses PyAV in-process when installed, otherwise (or on failure) ffmpeg.
+    Returns True if thumbnail created.
     """
+    if av is not None:
+        try:
+            if _thumbnail_pyav(video_path, thumb_path):
+                return True
+        except Exception as e:
+            logger.info("PyAV thumbnail failed, falling back to ffmpeg: %s", e)
+
     try:
-        # Use ffmpeg to grab a frame at 1 second; tolerate failures
+        # Use ffmpeg to grab a frame at 1 second (-ss before -i = fast seek); tolerate failures.
+        # Scale to 320px wide and stay single-threaded: the thread pool provides the parallelism.
         cmd = [
             "ffmpeg",
             "-y",
             "-ss", "00:00:01",
             "-i", str(video_path),
-            "-vframes", "1",
-            "-q:v", "2",
+            "-frames:v", "1",
+            "-vf", "scale=320:-2",
+            "-q:v", "5",
+            "-threads", "1",
             str(thumb_path),
         ]
         subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False, timeout=20)
@@ -514,39 +1106,554 @@ def generate_thumbnail(video_path: Path, thumb_path: Path):
         return False
 
 
+# thumbnails are generated off the request thread; ffmpeg runs in a subprocess so threads suffice
+THUMB_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count() or 2, thread_name_prefix="thumb")
+
+# replaced/deleted media is unlinked after the response; unlinking a multi-GB file can take
+# a while on some filesystems and the DB no longer points at it anyway
+CLEANUP_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cleanup")
+
+
+def _cleanup_files(urls):
+    """Best-effort unlink of /static/... media urls that are no longer referenced."""
+    for url in urls:
+        if not url:
+            continue
+        try:
+            (BASE_DIR / url.lstrip("/")).unlink(missing_ok=True)
+        except Exception as e:
+            logger.info("delete file error for %s: %s", url, e)
+
+
+# per-file thumbnail jobs of one upload run side by side (each ffmpeg is single-threaded)
+THUMB_MAX_PARALLEL = min(8, os.cpu_count() or 2)
+
+
+def _generate_thumbnails_parallel(jobs):
+    """Run generate_thumbnail for each (video_path, thumb_path) concurrently; results in job order."""
+    if len(jobs) <= 1:
+        return [generate_thumbnail(v, t) for v, t in jobs]
+    # a private pool: waiting on THUMB_EXECUTOR from inside one of its own jobs could deadlock
+    with ThreadPoolExecutor(max_workers=min(THUMB_MAX_PARALLEL, len(jobs)), thread_name_prefix="thumb-file") as ex:
+        return list(ex.map(lambda job: generate_thumbnail(*job), jobs))
+
+
+def generate_thumbnails_batch(jobs):
+    """
+    jobs: list of (video_path, thumb_path). Without PyAV, all thumbnails come from a
+    single ffmpeg process (one -i per video, one mapped output per thumbnail) so process
+    startup and codec init are paid once. On failure only the thumbnails the batch didn't
+    produce are regenerated per-file (in parallel).
+    Returns a list of bools (thumbnail created), in job order.
+    """
+    if av is not None or len(jobs) <= 1:
+        return _generate_thumbnails_parallel(jobs)
+
+    cmd = ["ffmpeg", "-y"]
+    for video_path, _ in jobs:
+        cmd += ["-ss", "00:00:01", "-i", str(video_path)]
+    for i, (_, thumb_path) in enumerate(jobs):
+        cmd += ["-map", f"{i}:v:0", "-frames:v", "1", "-vf", "scale=320:-2", "-q:v", "5", str(thumb_path)]
+    try:
+        p = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False, timeout=20 * len(jobs))
+        if p.returncode == 0 and all(t.exists() for _, t in jobs):
+            return [True] * len(jobs)
+        logger.info("batch thumbnail ffmpeg exited %s; retrying missing thumbnails per-file", p.returncode)
+    except Exception as e:
+        logger.info("batch thumbnail generation failed: %s", e)
+
+    # one bad input fails the whole batch; keep the thumbnails it did write and only redo the rest
+    results = [_nonempty(t) for _, t in jobs]
+    retry = [i for i, ok in enumerate(results) if not ok]
+    for i, ok in zip(retry, _generate_thumbnails_parallel([jobs[i] for i in retry])):
+        results[i] = ok
+    return results
+
+
+def _nonempty(path):
+    try:
+        return path.stat().st_size > 0
+    except OSError:
+        return False
+
+
+def _gen_and_update_thumbs(items):
+    """Background job: items is a list of (routine_id, video_path, thumb_path)."""
+    try:
+        results = generate_thumbnails_batch([(v, t) for _, v, t in items])
+        done = [(routine_id, video_path, thumb_path) for (routine_id, video_path, thumb_path), ok in zip(items, results) if ok]
+        if not done:
+            return
+        stale = []
+        with write_db() as db:
+            for routine_id, video_path, thumb_path in done:
+                # only while the routine still shows this video: a replace or delete that landed
+                # while the job ran must not get the old video's thumbnail written back
+                cur = db.execute(
+                    "UPDATE routines SET thumbnail_url = ? WHERE id = ? AND video_url = ?",
+                    (f"/static/videos/thumbnails/{thumb_path.name}", routine_id, f"/static/videos/{video_path.name}"),
+                )
+                if cur.rowcount == 0:
+                    stale.append(thumb_path)
+        for thumb_path in stale:
+            thumb_path.unlink(missing_ok=True)
+        invalidate_routines_cache()
+    except Exception:
+        logger.exception("background thumbnails failed for routines %s", [i[0] for i in items])
+
+
+# ---------- batched visit / play writes ----------
+# api_visit and api_track_play only enqueue events; a background thread applies
+# everything queued in the last EVENT_FLUSH_INTERVAL seconds in one transaction,
+# so many requests share a single commit (and a single git snapshot).
+EVENT_FLUSH_INTERVAL = 0.05
+_event_queue = collections.deque()
+
+
+def flush_events():
+    """Apply all queued visit/play events in one write transaction. Returns the number applied."""
+    visits = collections.Counter()  # (username, country) -> visits
+    views = collections.Counter()  # routine_id -> plays
+    plays = []
+    while True:
+        try:
+            kind, args = _event_queue.popleft()
+        except IndexError:
+            break
+        # one malformed event must not cost the rest of the batch already popped
+        try:
+            if kind == "visit":
+                visits[args] += 1
+            else:
+                user_id, routine_id = args
+                views[routine_id] += 1
+                plays.append(args)
+        except (TypeError, ValueError):
+            logger.warning("dropping malformed %s event: %r", kind, args)
+
+    if not visits and not plays:
+        return 0
+
+    with write_db() as db:
+        if visits:
+            db.executemany(SQL_ADD_VISITS, [(n, u, c) for (u, c), n in visits.items()])
+        if plays:
+            db.executemany(SQL_ADD_ROUTINE_VIEWS, [(n, rid) for rid, n in views.items()])
+            db.executemany(SQL_INSERT_PLAY, plays)
+
+    n_visits = sum(visits.values())
+    _git_queue.put((f"activity: {n_visits} visit(s), {len(plays)} play(s)", False))
+    return n_visits + len(plays)
+
+
+def _event_flush_loop():
+    while True:
+        time.sleep(EVENT_FLUSH_INTERVAL)
+        try:
+            flush_events()
+        except Exception:
+            logger.exception("event flush failed")
+
+
+atexit.register(flush_events)
+
+
+# ---------- upload validation ----------
+# container signatures accepted for video uploads: every (offset, magic bytes) pair must match
+VIDEO_MAGIC = (
+    ((4, b"ftyp"),),  # MP4 / MOV / M4V (ISO base media)
+    ((0, b"\x1aE\xdf\xa3"),),  # WebM / Matroska (EBML)
+    ((0, b"RIFF"), (8, b"AVI ")),  # AVI (plain RIFF would also let WAV / WebP through)
+)
+VIDEO_SNIFF_BYTES = 16
+
+
+def looks_like_video(head):
+    return any(all(head[off:off + len(magic)] == magic for off, magic in sig) for sig in VIDEO_MAGIC)
+
+
+def read_head(stream, n=VIDEO_SNIFF_BYTES):
+    """Read up to n bytes; a socket-backed stream may return fewer per read() before EOF."""
+    head = b""
+    while len(head) < n:
+        chunk = stream.read(n - len(head))
+        if not chunk:
+            break
+        head += chunk
+    return head
+
+
+def sniff_upload(f):
+    """Check the first bytes of an uploaded FileStorage without consuming it."""
+    head = read_head(f.stream)
+    f.stream.seek(0)
+    return looks_like_video(head)
+
+
+# ---------- saving uploads ----------
+@lru_cache(maxsize=2048)
+def safe_filename(name):
+    """secure_filename, memoized: batch uploads and re-uploads tend to repeat names."""
+    return secure_filename(name)
+
+
+# Werkzeug's FileStorage.save copies in 16 KiB chunks; videos are large, so copy in
+# 4 MiB chunks through an unbuffered file (one write() syscall per chunk).
+UPLOAD_COPY_BUFFER = 4 * 1024 * 1024
+# Multipart file parts over 500 KiB are spooled by Werkzeug to a real temp file; on Linux
+# those are copied kernel-side (copy_file_range, else sendfile) without passing through Python.
+KERNEL_COPY = sys.platform.startswith("linux")
+KERNEL_COPY_CHUNK = 64 * 1024 * 1024
+
+
+def _spooled_fileno(src):
+    """fd of the on-disk file behind an upload stream, or None (in-memory / socket streams)."""
+    # SpooledTemporaryFile keeps its backing file in _file: BytesIO until it rolls to disk
+    raw = getattr(src, "_file", src)
+    try:
+        return raw, raw.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return raw, None
+
+
+def _kernel_copy(in_fd, out_fd, offset):
+    """Copy in_fd from offset to EOF onto out_fd's current position; returns the end offset."""
+    use_cfr = hasattr(os, "copy_file_range")
+    while True:
+        if use_cfr:
+            try:
+                n = os.copy_file_range(in_fd, out_fd, KERNEL_COPY_CHUNK, offset_src=offset)
+            except OSError as e:
+                # e.g. temp dir and videos dir on different filesystems: use sendfile instead
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+                use_cfr = False
+                continue
+        else:
+            n = os.sendfile(out_fd, in_fd, offset, KERNEL_COPY_CHUNK)
+        if n == 0:
+            return offset
+        offset += n
+
+
+def save_stream(src, path, head=b""):
+    """
+    Copy the readable stream src (optionally preceded by already-read bytes head) to path.
+    A partially written file is removed before the error is re-raised.
+    """
+    try:
+        with open(path, "wb", buffering=0) as dst:
+            if head:
+                dst.write(head)
+            raw, in_fd = _spooled_fileno(src) if KERNEL_COPY else (src, None)
+            if in_fd is not None:
+                raw.seek(_kernel_copy(in_fd, dst.fileno(), raw.tell()))
+            else:
+                shutil.copyfileobj(src, dst, UPLOAD_COPY_BUFFER)
+    except BaseException:
+        try:
+            Path(path).unlink(missing_ok=True)
+        except OSError:
+            pass
+        raise
+
+
 # ---------- admin auth helpers ----------
+# Password hashing is deliberately slow (~hundreds of ms of CPU). Run it on a small
+# dedicated pool so at most PASSWORD_HASH_WORKERS hashes burn CPU at once and a burst
+# of login attempts can't tie up every request thread.
+PASSWORD_HASH_WORKERS = 2
+PASSWORD_HASH_TIMEOUT = 30
+_HASH_EXECUTOR = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="pwhash")
+
+
+def hash_password(password):
+    return _HASH_EXECUTOR.submit(generate_password_hash, password).result(timeout=PASSWORD_HASH_TIMEOUT)
+
+
+def verify_password(password_hash, password):
+    return _HASH_EXECUTOR.submit(check_password_hash, password_hash, password).result(timeout=PASSWORD_HASH_TIMEOUT)
+
+
+# every login attempt can cost a full password hash, so cap attempts per client IP
+# (request.remote_addr is the real client behind the proxy, see TRUSTED_PROXY_HOPS)
+# (sliding window, in-process; each gunicorn worker keeps its own counts)
+LOGIN_MAX_ATTEMPTS = int(os.environ.get("LOGIN_MAX_ATTEMPTS", "10"))
+LOGIN_WINDOW_SEC = 60
+_login_attempts = {}  # ip -> deque of attempt times
+_login_lock = threading.Lock()
+
+
+def login_rate_limited(ip):
+    """Record an attempt from ip; True if it exceeds LOGIN_MAX_ATTEMPTS in the last LOGIN_WINDOW_SEC."""
+    now = time.monotonic()
+    cutoff = now - LOGIN_WINDOW_SEC
+    with _login_lock:
+        attempts = _login_attempts.setdefault(ip, collections.deque())
+        while attempts and attempts[0] < cutoff:
+            attempts.popleft()
+        if len(attempts) >= LOGIN_MAX_ATTEMPTS:
+            return True
+        attempts.append(now)
+        # drop idle clients so the table can't grow without bound
+        if len(_login_attempts) > 10000:
+            for k in [k for k, v in _login_attempts.items() if not v or v[-1] < cutoff]:
+                del _login_attempts[k]
+        return False
+
+
+# admins are never deleted and never lose their credentials at runtime, so once one
+# exists the answer can't change back
+_admin_exists_latch = False
+
+
 def admin_exists():
-    db = get_db()
-    cur = db.execute("SELECT COUNT(1) AS cnt FROM users WHERE admin = 1")
-    return cur.fetchone()["cnt"] > 0
+    global _admin_exists_latch
+    if _admin_exists_latch:
+        return True
+    db = get_read_db()
+    cur = db.execute(SQL_COUNT_ADMINS)
+    _admin_exists_latch = cur.fetchone()["cnt"] > 0
+    return _admin_exists_latch
+
+
+# admin rows found by session id / api key, kept for ADMIN_CACHE_TTL seconds so admin
+# requests skip the lookup query; only successful lookups are cached
+ADMIN_CACHE_TTL = 30
+_admin_cache = {}  # ("id", admin_id) | ("key", api_key) -> (expires_at, {"id", "username", "display"})
+
+
+def invalidate_admin_cache():
+    _admin_cache.clear()
+
+
+def _lookup_admin(kind, value, sql):
+    now = time.monotonic()
+    hit = _admin_cache.get((kind, value))
+    if hit and hit[0] > now:
+        return hit[1]
+    row = get_read_db().execute(sql, (value,)).fetchone()
+    if not row:
+        return None
+    # handlers only need who the admin is; "display" is what commit messages show
+    user = {"id": row["id"], "username": row["username"], "display": row["username"] or row["id"]}
+    _admin_cache[(kind, value)] = (now + ADMIN_CACHE_TTL, user)
+    return user
 
 
 def require_admin():
-    db = get_db()
+    # memoized for the rest of the request
+    user = getattr(g, "_admin_user", None)
+    if user is not None:
+        return user
+
     admin_id = session.get("admin_id")
     if admin_id:
-        cur = db.execute("SELECT * FROM users WHERE id = ? AND admin = 1", (admin_id,))
-        user = cur.fetchone()
+        user = _lookup_admin("id", admin_id, SQL_SELECT_ADMIN_BY_ID)
         if user:
+            g._admin_user = user
             return user
 
     # legacy header fallback
     key = request.headers.get("X-Admin-Key") or request.args.get("admin_key")
     if key:
-        cur = db.execute("SELECT * FROM users WHERE api_key = ? AND admin = 1", (key,))
-        user = cur.fetchone()
+        user = _lookup_admin("key", key, SQL_SELECT_ADMIN_BY_KEY)
         if user:
+            g._admin_user = user
             return user
 
     abort(401, description="admin authentication required")
 
 
+# ---------- heartbeat log ----------
+# Pings only append to an in-memory deque; a background thread writes whatever has queued
+# up every HEARTBEAT_FLUSH_INTERVAL seconds through one append-mode handle per process
+# (HEARTBEAT_BATCH lines per write(), fsync at most every HEARTBEAT_FSYNC_INTERVAL).
+# The deque is bounded: a ping storm drops the oldest lines instead of growing memory.
+# O_APPEND keeps copytruncate-style log rotation safe without reopening.
+HEARTBEAT_LOG = SNAPSHOT_DIR / "heartbeats.log"
+HEARTBEAT_FLUSH_INTERVAL = 0.5
+HEARTBEAT_BATCH = 1024
+HEARTBEAT_QUEUE_MAX = 10000
+HEARTBEAT_FSYNC_INTERVAL = 1.0
+_hb_queue = collections.deque(maxlen=HEARTBEAT_QUEUE_MAX)
+_hb_fh = None
+_hb_lock = threading.Lock()
+_hb_last_fsync = 0.0
+
+
+def heartbeat_json(payload):
+    """Compact JSON for a heartbeat line; orjson when installed, byte-identical stdlib fallback."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload, default=str, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:  # orjson.JSONEncodeError subclasses TypeError
+            pass
+    return json.dumps(payload, default=str, separators=(",", ":"), ensure_ascii=False)
+
+
+# most pingers send nothing (or exactly this); its log text is precomputed
+EMPTY_PULSE = {"message": "pulse"}
+EMPTY_PULSE_JSON = heartbeat_json(EMPTY_PULSE)
+
+
+def write_heartbeat(line):
+    _hb_queue.append(line)
+
+
+def flush_heartbeats():
+    """Write all queued heartbeat lines. Returns the number written."""
+    global _hb_fh, _hb_last_fsync
+    written = 0
+    with _hb_lock:
+        while _hb_queue:
+            lines = []
+            while _hb_queue and len(lines) < HEARTBEAT_BATCH:
+                lines.append(_hb_queue.popleft())
+            if _hb_fh is None:
+                _hb_fh = HEARTBEAT_LOG.open("a", encoding="utf-8")
+            _hb_fh.write("".join(lines))
+            written += len(lines)
+        if written:
+            _hb_fh.flush()
+            now = time.monotonic()
+            if now - _hb_last_fsync >= HEARTBEAT_FSYNC_INTERVAL:
+                os.fsync(_hb_fh.fileno())
+                _hb_last_fsync = now
+    return written
+
+
+def _heartbeat_flush_loop():
+    while True:
+        time.sleep(HEARTBEAT_FLUSH_INTERVAL)
+        try:
+            flush_heartbeats()
+        except Exception:
+            logger.exception("heartbeat flush failed")
+
+
+def close_heartbeat_log():
+    """Close the shared handle; the next heartbeat reopens it (e.g. after moving the file away)."""
+    global _hb_fh
+    with _hb_lock:
+        if _hb_fh is not None:
+            try:
+                _hb_fh.close()
+            except Exception:
+                pass
+            _hb_fh = None
+
+
+def tail_lines(path, n, blk=8192):
+    """Last n lines of a file, reading backwards from the end in blk-sized steps (like tail -n)."""
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        data = b""
+        # n + 1 newlines guarantees n complete lines (the file normally ends with one)
+        while pos > 0 and data.count(b"\n") <= n:
+            step = min(blk, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    return [line.decode("utf-8", "replace") for line in data.splitlines()[-n:]]
+
+
+# atexit runs LIFO: queued lines are written before the handle is closed
+atexit.register(close_heartbeat_log)
+atexit.register(flush_heartbeats)
+
+
+# ---------- per-process startup ----------
+def start_background_threads():
+    global _git_worker
+    threading.Thread(target=_optimize_loop, name="sqlite-optimize", daemon=True).start()
+    threading.Thread(target=_event_flush_loop, name="event-flush", daemon=True).start()
+    threading.Thread(target=_heartbeat_flush_loop, name="heartbeat-flush", daemon=True).start()
+    _git_worker = threading.Thread(target=_git_worker_loop, name="git-sync", daemon=True)
+    _git_worker.start()
+
+
+def init_worker_process():
+    """
+    Create per-process resources: the writer connection, executors and background threads.
+    Runs in each gunicorn worker (post_fork hook with preload_app) or lazily on first use
+    (ensure_worker_process), never at import: threads and executors don't survive fork,
+    and a SQLite connection must not be shared across processes.
+    """
+    global WRITER_CONN, WRITER_LOCK, THUMB_EXECUTOR, CLEANUP_EXECUTOR, _HASH_EXECUTOR, _git_queue, _git_stop, _snapshot_conn
+    global _hb_fh, _hb_lock, _worker_pid
+    if os.getpid() != _IMPORT_PID:
+        # forked: drop everything inherited from the parent (locks may be held, queued items
+        # are the parent's); in the importing process the module-level objects are still good
+        WRITER_LOCK = threading.Lock()
+        THUMB_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count() or 2, thread_name_prefix="thumb")
+        CLEANUP_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cleanup")
+        _HASH_EXECUTOR = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="pwhash")
+        _event_queue.clear()
+        _git_queue = queue.Queue()
+        _git_stop = threading.Event()
+        _snapshot_conn = None  # never reuse the parent's handle; reopened lazily
+        _hb_fh, _hb_lock = None, threading.Lock()
+        _hb_queue.clear()
+    WRITER_CONN = open_writer_conn()
+    # set last: other threads only skip ensure_worker_process() once everything above exists
+    _worker_pid = os.getpid()
+    start_background_threads()
+
+
+_IMPORT_PID = os.getpid()
+_worker_pid = None  # process whose resources init_worker_process() set up
+_worker_init_lock = threading.Lock()
+
+
+def ensure_worker_process():
+    """Run init_worker_process() once in the current process (dev server, scripts, no post_fork)."""
+    if _worker_pid != os.getpid():
+        with _worker_init_lock:
+            if _worker_pid != os.getpid():
+                init_worker_process()
+
+
+@app.before_request
+def _ensure_worker_process():
+    ensure_worker_process()
+
+
 # ---------- serve manifest explicitly (helps with correct MIME) ----------
 @app.route('/manifest.json')
 def manifest():
     return send_from_directory('static', 'manifest.json', mimetype='application/manifest+json')
 
 
+@app.after_request
+def cache_thumbnails(resp):
+    # only real hits: a thumbnail asked for before it exists must not be cached as a 404
+    if resp.status_code in (200, 304) and request.path.startswith("/static/videos/thumbnails/"):
+        resp.headers["Cache-Control"] = THUMB_CACHE_CONTROL
+    return resp
+
+
+# ---------- video delivery ----------
+@app.route("/video/<int:routine_id>")
+def video(routine_id):
+    db = get_read_db()
+    row = db.execute("SELECT video_url FROM routines WHERE id = ?", (routine_id,)).fetchone()
+    if not row or not row["video_url"]:
+        abort(404)
+
+    video_url = row["video_url"]
+    if not video_url.startswith("/static/videos/"):
+        # metadata-only routines point at a remote URL
+        return redirect(video_url)
+
+    save_name = video_url[len("/static/videos/"):]
+    if VIDEO_ACCEL_PREFIX:
+        resp = Response(mimetype=mimetypes.guess_type(save_name)[0] or "application/octet-stream")
+        resp.headers["X-Accel-Redirect"] = VIDEO_ACCEL_PREFIX + save_name
+        return resp
+    return send_from_directory(VIDEOS_DIR, save_name, conditional=True)
+
+
 # ---------- frontend routes ----------
 @app.route("/")
 def index():
@@ -576,12 +1683,10 @@ def admin_path_54():
 # ---------- public APIs (users, routines, tracking) ----------
 @app.route("/api/routines")
 def api_routines():
-    db = get_db()
-    cur = db.execute(
-        "SELECT id, title, category, difficulty, duration, video_url, thumbnail_url, description, uploaded_at, views FROM routines ORDER BY uploaded_at DESC"
-    )
-    rows = [row_to_dict(r) for r in cur.fetchall()]
-    return jsonify(rows)
+    body, etag = routines_json(get_read_db())
+    resp = Response(body, mimetype="application/json")
+    resp.set_etag(etag)
+    return resp.make_conditional(request)
 
 
 @app.route("/api/register", methods=["POST"])
@@ -598,52 +1703,22 @@ def api_register():
     if not username or not country:
         return jsonify({"error": "username and country required"}), 400
 
-    db = get_db()
-    now = datetime.utcnow()
-
-    cur = db.execute("SELECT * FROM users WHERE username = ? AND country = ?", (username, country))
-    user = cur.fetchone()
+    with write_db() as db:
+        user = db.execute(SQL_TOUCH_USER, (age, occupation, username, country)).fetchone()
+        is_new = user is None
+        if is_new:
+            user = db.execute(SQL_INSERT_USER, (username, age, country, occupation)).fetchone()
 
-    if user:
-        db.execute(
-            "UPDATE users SET age = ?, occupation = ?, last_seen = ?, visits = visits + 1 WHERE id = ?",
-            (age, occupation, now, user["id"]),
-        )
-        db.commit()
-        # snapshot & push
-        try:
-            push_to_git(paths=None, message=f"user update: {username} ({country})", include_media=False)
-        except Exception:
-            logger.exception("git push failed after user update")
-
-        cur = db.execute("SELECT * FROM users WHERE id = ?", (user["id"],))
-        user = cur.fetchone()
-        resp = row_to_dict(user)
-        resp.pop("password_hash", None)
-        if resp.get("admin"):
-            resp["admin_api_key"] = resp.get("api_key")
-        return jsonify(resp)
-
-    # create new normal user
-    cur = db.execute("SELECT COUNT(1) AS cnt FROM users WHERE admin = 1")
-    _ = cur.fetchone()
-
-    cur = db.execute(
-        "INSERT INTO users (username, age, country, occupation, admin, api_key, visits, last_seen) VALUES (?,?,?,?,?,?,?,?)",
-        (username, age, country, occupation, 0, None, 1, now),
-    )
-    db.commit()
+    resp = row_to_dict(user)
+    if is_new:
+        invalidate_metrics_cache()
+    resp.pop("password_hash", None)
+    if resp.get("admin"):
+        resp["admin_api_key"] = resp.get("api_key")
 
-    # snapshot & push (best-effort)
-    try:
-        push_to_git(paths=None, message=f"user register: {username} ({country})", include_media=False)
-    except Exception:
-        logger.exception("git push failed after user register")
+    # snapshot & push in the background (best-effort)
+    _git_queue.put((f"user {'register' if is_new else 'update'}: {username} ({country})", False))
 
-    user_id = cur.lastrowid
-    new_user = db.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
-    resp = row_to_dict(new_user)
-    resp.pop("password_hash", None)
     return jsonify(resp)
 
 
@@ -654,20 +1729,8 @@ def api_visit():
     country = (data.get("country") or "").strip()
     if not username or not country:
         return jsonify({"error": "username+country required"}), 400
-    db = get_db()
-    now = datetime.utcnow()
-    db.execute(
-        "UPDATE users SET visits = visits + 1, last_seen = ? WHERE username = ? AND country = ?",
-        (now, username, country),
-    )
-    db.commit()
-
-    try:
-        push_to_git(paths=None, message=f"visit: {username} ({country})", include_media=False)
-    except Exception:
-        logger.exception("git push failed after visit")
-
-    return jsonify({"ok": True})
+    _event_queue.append(("visit", (username, country)))
+    return jsonify({"ok": True}), 202
 
 
 @app.route("/api/track_play", methods=["POST"])
@@ -678,24 +1741,19 @@ def api_track_play():
     routine_id = data.get("routine_id")
     if not username or not country or not routine_id:
         return jsonify({"error": "username,country,routine_id required"}), 400
-
-    db = get_db()
-    cur = db.execute("SELECT id FROM users WHERE username = ? AND country = ?", (username, country))
-    row = cur.fetchone()
+    # events are aggregated later in flush_events: only let a plain integer id into the queue
+    if isinstance(routine_id, str) and routine_id.isdigit():
+        routine_id = int(routine_id)
+    if type(routine_id) is not int:
+        return jsonify({"error": "routine_id must be an integer"}), 400
+
+    db = get_read_db()
+    row = db.execute(SQL_SELECT_USER_ID_BY_UC, (username, country)).fetchone()
     if not row:
         return jsonify({"error": "user not found"}), 404
-    user_id = row["id"]
-
-    db.execute("UPDATE routines SET views = views + 1 WHERE id = ?", (routine_id,))
-    db.execute("INSERT INTO plays (user_id, routine_id) VALUES (?,?)", (user_id, routine_id))
-    db.commit()
-
-    try:
-        push_to_git(paths=None, message=f"play: user {username} played {routine_id}", include_media=False)
-    except Exception:
-        logger.exception("git push failed after track_play")
 
-    return jsonify({"ok": True})
+    _event_queue.append(("play", (row["id"], routine_id)))
+    return jsonify({"ok": True}), 202
 
 
 @app.route("/api/set_reminder", methods=["POST"])
@@ -706,14 +1764,10 @@ def api_set_reminder():
     enabled = int(data.get("enabled", 1))
     if not username or not country:
         return jsonify({"error": "username+country required"}), 400
-    db = get_db()
-    db.execute("UPDATE users SET reminders_set = ? WHERE username = ? AND country = ?", (1 if enabled else 0, username, country))
-    db.commit()
+    with write_db() as db:
+        db.execute("UPDATE users SET reminders_set = ? WHERE username = ? AND country = ?", (1 if enabled else 0, username, country))
 
-    try:
-        push_to_git(paths=None, message=f"reminder: {username} ({country}) => {enabled}", include_media=False)
-    except Exception:
-        logger.exception("git push failed after set_reminder")
+    _git_queue.put((f"reminder: {username} ({country}) => {enabled}", False))
 
     return jsonify({"ok": True})
 
@@ -721,14 +1775,12 @@ def api_set_reminder():
 # ---------- admin registration & login (username + password) ----------
 @app.route("/api/admin/exists")
 def api_admin_exists():
-    db = get_db()
-    cur = db.execute("SELECT COUNT(1) AS cnt FROM users WHERE admin = 1")
-    exists = cur.fetchone()["cnt"] > 0
-    return jsonify({"admin_exists": exists})
+    return jsonify({"admin_exists": admin_exists()})
 
 
 @app.route("/api/admin/register", methods=["POST"])
 def api_admin_register():
+    global _admin_exists_latch
     if admin_exists():
         return jsonify({"error": "admin already exists"}), 403
 
@@ -738,24 +1790,34 @@ def api_admin_register():
     if not username or not password:
         return jsonify({"error": "username and password required"}), 400
 
-    password_hash = generate_password_hash(password)
+    try:
+        password_hash = hash_password(password)
+    except FutureTimeoutError:
+        return jsonify({"error": "server busy, try again"}), 503
     api_key = secrets.token_urlsafe(28)
-    now = datetime.utcnow()
 
-    db = get_db()
-    cur = db.execute(
-        "INSERT INTO users (username, age, country, occupation, admin, api_key, password_hash, visits, last_seen) VALUES (?,?,?,?,?,?,?,?,?)",
-        (username, 0, "__admin__", "", 1, api_key, password_hash, 0, now),
-    )
-    db.commit()
-    admin_id = cur.lastrowid
+    with write_db() as db:
+        # an admin row restored from data.sql keeps its id (and uploads); give it credentials
+        row = db.execute(
+            "UPDATE users SET api_key = ?, password_hash = ?, last_seen = CURRENT_TIMESTAMP "
+            "WHERE username = ? AND country = '__admin__' AND admin = 1 "
+            "AND password_hash IS NULL AND api_key IS NULL RETURNING id",
+            (api_key, password_hash, username),
+        ).fetchone()
+        if row is not None:
+            admin_id = row[0]
+        else:
+            cur = db.execute(
+                "INSERT INTO users (username, age, country, occupation, admin, api_key, password_hash, visits, last_seen) VALUES (?,?,?,?,?,?,?,?,CURRENT_TIMESTAMP)",
+                (username, 0, "__admin__", "", 1, api_key, password_hash, 0),
+            )
+            admin_id = cur.lastrowid
     session['admin_id'] = admin_id
+    _admin_exists_latch = True
+    invalidate_admin_cache()
 
     # snapshot & push admin creation
-    try:
-        push_to_git(paths=None, message=f"admin created: {username}", include_media=False)
-    except Exception:
-        logger.exception("git push failed after admin register")
+    _git_queue.put((f"admin created: {username}", False))
 
     return jsonify({"ok": True, "admin_id": admin_id})
 
@@ -767,8 +1829,10 @@ def api_admin_login():
     password = (data.get("password") or "").strip()
     if not username or not password:
         return jsonify({"error": "username and password required"}), 400
+    if login_rate_limited(request.remote_addr):
+        return jsonify({"error": "too many login attempts, try again later"}), 429
 
-    db = get_db()
+    db = get_read_db()
     cur = db.execute("SELECT * FROM users WHERE username = ? AND admin = 1", (username,))
     user = cur.fetchone()
     if not user:
@@ -779,7 +1843,11 @@ def api_admin_login():
     if not ph:
         return jsonify({"error": "this admin account does not support password login; use admin key"}), 400
 
-    if not check_password_hash(ph, password):
+    try:
+        valid = verify_password(ph, password)
+    except FutureTimeoutError:
+        return jsonify({"error": "server busy, try again"}), 503
+    if not valid:
         return jsonify({"error": "invalid password"}), 403
 
     session['admin_id'] = user["id"]
@@ -788,7 +1856,8 @@ def api_admin_login():
 
 @app.route("/api/admin/logout", methods=["POST"])
 def api_admin_logout():
-    session.pop('admin_id', None)
+    admin_id = session.pop('admin_id', None)
+    _admin_cache.pop(("id", admin_id), None)
     return jsonify({"ok": True})
 
 
@@ -796,25 +1865,19 @@ def api_admin_logout():
 @app.route("/api/admin/users")
 def api_admin_users():
     admin = require_admin()
-    db = get_db()
-    cur = db.execute("SELECT id,username,age,country,occupation,admin,visits,reminders_set,last_seen,created_at FROM users ORDER BY created_at DESC")
-    users = [row_to_dict(r) for r in cur.fetchall()]
-    return jsonify(users)
+    return json_rows_response(get_read_db(), SQL_ADMIN_USERS_JSON)
 
 
 @app.route("/api/admin/videos")
 def api_admin_videos():
     admin = require_admin()
-    db = get_db()
-    cur = db.execute("SELECT id,title,category,difficulty,duration,video_url,thumbnail_url,description,uploaded_at,views FROM routines ORDER BY uploaded_at DESC")
-    rows = [row_to_dict(r) for r in cur.fetchall()]
-    return jsonify(rows)
+    body, _ = routines_json(get_read_db())
+    return Response(body, mimetype="application/json")
 
 
 @app.route("/api/admin/upload_video", methods=["POST"])
 def api_admin_upload_video():
     admin = require_admin()
-    db = get_db()
     data = request.get_json() or request.form
     title = data.get("title", "Untitled")
     category = data.get("category", "Special")
@@ -829,16 +1892,16 @@ def api_admin_upload_video():
     if not video_url:
         return jsonify({"error": "video_url required"}), 400
 
-    db.execute(
-        "INSERT INTO routines (title,category,difficulty,duration,video_url,description,uploaded_by) VALUES (?,?,?,?,?,?,?)",
-        (title, category, difficulty, duration, video_url, description, admin["id"]),
-    )
-    db.commit()
+    with write_db() as db:
+        db.execute(
+            "INSERT INTO routines (title,category,difficulty,duration,video_url,description,uploaded_by) VALUES (?,?,?,?,?,?,?)",
+            (title, category, difficulty, duration, video_url, description, admin["id"]),
+        )
 
-    try:
-        push_to_git(paths=None, message=f"video metadata added: {title}", include_media=False)
-    except Exception:
-        logger.exception("git push failed after upload_video")
+    invalidate_routines_cache()
+    invalidate_metrics_cache()
+
+    _git_queue.put((f"video metadata added: {title}", False))
 
     return jsonify({"ok": True})
 
@@ -856,6 +1919,11 @@ def api_admin_upload_file():
     if not files or all(f.filename == '' for f in files):
         return jsonify({"error": "no video files provided"}), 400
 
+    # reject non-video uploads before any of them is written to disk
+    rejected = [f.filename for f in files if f and f.filename and not sniff_upload(f)]
+    if rejected:
+        return jsonify({"error": "unsupported file type", "files": rejected}), 415
+
     title_form = (request.form.get("title") or "").strip()
     category = (request.form.get("category") or "Special").strip()
     difficulty = (request.form.get("difficulty") or "medium").strip()
@@ -865,48 +1933,57 @@ def api_admin_upload_file():
         duration = 0
     description = (request.form.get("description") or "").strip()
 
-    db = get_db()
     saved_urls = []
     media_paths = []
+    rows = []
+    thumb_jobs = []
+    # one stamp per request; the random suffix keeps names in the same batch unique
+    stamp = time.time_ns()
 
     for f in files:
         if not f or f.filename == '':
             continue
 
-        filename = secure_filename(f.filename)
-        stamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+        filename = safe_filename(f.filename)
         rnd = secrets.token_hex(6)
         save_name = f"{stamp}_{rnd}_{filename}"
         save_path = VIDEOS_DIR / save_name
 
         try:
-            f.save(save_path)
+            save_stream(f.stream, save_path)
             media_paths.append(str(save_path.relative_to(BASE_DIR)))
         except Exception as e:
             logger.info(f"failed saving {filename}: {e}")
             continue
 
-        thumb_name = f"{save_name}.jpg"
-        thumb_path = THUMBS_DIR / thumb_name
-        thumb_created = generate_thumbnail(save_path, thumb_path)
-        thumbnail_url = f"/static/videos/thumbnails/{thumb_name}" if thumb_created else None
+        thumb_path = THUMBS_DIR / f"{save_name}.jpg"
 
         title = title_form or filename or "Untitled"
         video_url = f"/static/videos/{save_name}"
 
-        db.execute(
-            "INSERT INTO routines (title,category,difficulty,duration,video_url,thumbnail_url,description,uploaded_by) VALUES (?,?,?,?,?,?,?,?)",
-            (title, category, difficulty, duration, video_url, thumbnail_url, description, admin["id"]),
-        )
+        # thumbnail_url stays NULL until the background job fills it in
+        rows.append((title, category, difficulty, duration, video_url, None, description, admin["id"]))
+        thumb_jobs.append((save_path, thumb_path))
         saved_urls.append(video_url)
 
-    db.commit()
+    # insert all routines with one prepared statement in one write transaction (file saving
+    # stays outside the lock). Under BEGIN IMMEDIATE nothing else can insert, and AUTOINCREMENT
+    # hands out consecutive ids, so the batch's ids end at last_insert_rowid().
+    routine_ids = []
+    if rows:
+        with write_db() as db:
+            db.executemany(SQL_INSERT_ROUTINE, rows)
+            (last_id,) = db.execute("SELECT last_insert_rowid()").fetchone()
+        routine_ids = list(range(last_id - len(rows) + 1, last_id + 1))
+
+    if routine_ids:
+        THUMB_EXECUTOR.submit(_gen_and_update_thumbs, [(rid, v, t) for rid, (v, t) in zip(routine_ids, thumb_jobs)])
+
+    invalidate_routines_cache()
+    invalidate_metrics_cache()
 
     # snapshot & push; include media only when explicitly enabled
-    try:
-        push_to_git(paths=None, message=f"files uploaded by admin {admin['username'] if admin and 'username' in admin else admin['id']}", include_media=True)
-    except Exception:
-        logger.exception("git push failed after upload_file")
+    _git_queue.put((f"files uploaded by admin {admin['display']}", True))
 
     if not saved_urls:
         return jsonify({"error": "no files were saved"}), 500
@@ -922,35 +1999,61 @@ def api_admin_delete_video():
     if not routine_id:
         return jsonify({"error": "routine_id required"}), 400
 
-    db = get_db()
-    cur = db.execute("SELECT * FROM routines WHERE id = ?", (routine_id,))
-    row = cur.fetchone()
+    with write_db() as db:
+        row = db.execute(SQL_DELETE_ROUTINE, (routine_id,)).fetchone()
     if not row:
         return jsonify({"error": "routine not found"}), 404
 
-    r = row_to_dict(row)
+    invalidate_routines_cache()
+    invalidate_metrics_cache()
+    CLEANUP_EXECUTOR.submit(_cleanup_files, [row["video_url"], row["thumbnail_url"]])
+
+    # after deleting a routine, snapshot and push; media will not be included by default
+    _git_queue.put((f"deleted routine {routine_id}", False))
+
+    return jsonify({"ok": True})
+
+
+def _finish_replace_video(routine_id, r, filename, save_name, save_path, title=None, description=None):
+    """Shared tail of the replace routes: thumbnail, DB update, old-file cleanup, git push."""
+    thumb_name = f"{save_name}.jpg"
+    thumb_path = THUMBS_DIR / thumb_name
+    thumb_created = generate_thumbnail(save_path, thumb_path)
+    thumbnail_url = f"/static/videos/thumbnails/{thumb_name}" if thumb_created else None
+    video_url = f"/static/videos/{save_name}"
+
+    new_title = (title or r["title"] or filename).strip()
+    new_desc = (description or r["description"] or "").strip()
     try:
-        if r.get("video_url"):
-            video_path = BASE_DIR / r["video_url"].lstrip("/")
-            if video_path.exists():
-                video_path.unlink()
-        if r.get("thumbnail_url"):
-            thumb_path = BASE_DIR / r["thumbnail_url"].lstrip("/")
-            if thumb_path.exists():
-                thumb_path.unlink()
+        # read the current files and swap in the new ones in one BEGIN IMMEDIATE transaction,
+        # so two concurrent replaces can't both delete the same "old" file and leak the other
+        with write_db() as wdb:
+            current = wdb.execute(SQL_SELECT_ROUTINE_FILES, (routine_id,)).fetchone()
+            if current:
+                wdb.execute(
+                    "UPDATE routines SET title=?, video_url=?, thumbnail_url=?, description=? WHERE id=?",
+                    (new_title, video_url, thumbnail_url, new_desc, routine_id),
+                )
     except Exception as e:
-        logger.info("delete file error: %s", e)
+        logger.info("db update error: %s", e)
+        return jsonify({"error": "could not update DB"}), 500
+    if not current:
+        # routine deleted while the upload was in flight: drop the orphaned new files
+        for p in (save_path, thumb_path):
+            try:
+                p.unlink(missing_ok=True)
+            except Exception as e:
+                logger.info("orphan cleanup failed: %s", e)
+        return jsonify({"error": "routine not found"}), 404
+    old_video, old_thumb = current["video_url"], current["thumbnail_url"]
 
-    db.execute("DELETE FROM routines WHERE id = ?", (routine_id,))
-    db.commit()
+    invalidate_routines_cache()
+    invalidate_metrics_cache()
+    CLEANUP_EXECUTOR.submit(_cleanup_files, [old_video, old_thumb])
 
-    try:
-        # after deleting a routine, snapshot and push; media will not be included by default
-        push_to_git(paths=None, message=f"deleted routine {routine_id}", include_media=False)
-    except Exception:
-        logger.exception("git push failed after delete_video")
+    _git_queue.put((f"replaced video for routine {routine_id}", True))
 
-    return jsonify({"ok": True})
+    return jsonify({"ok": True, "video_url": video_url, "thumbnail_url": thumbnail_url})
 
 
 @app.route("/api/admin/replace_video", methods=["POST"])
@@ -963,91 +2066,101 @@ def api_admin_replace_video():
     file = request.files.get("video_file")
     if not file or file.filename == "":
         return jsonify({"error": "video_file required"}), 400
+    if not sniff_upload(file):
+        return jsonify({"error": "unsupported file type"}), 415
 
-    db = get_db()
-    cur = db.execute("SELECT * FROM routines WHERE id = ?", (routine_id,))
-    row = cur.fetchone()
-    if not row:
+    r = get_read_db().execute(SQL_SELECT_ROUTINE_TEXT, (routine_id,)).fetchone()
+    if not r:
         return jsonify({"error": "routine not found"}), 404
 
-    r = row_to_dict(row)
-    old_video = r.get("video_url")
-    old_thumb = r.get("thumbnail_url")
-
-    filename = secure_filename(file.filename)
-    stamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+    filename = safe_filename(file.filename)
+    stamp = time.time_ns()
     rnd = secrets.token_hex(6)
     save_name = f"{stamp}_{rnd}_{filename}"
     save_path = VIDEOS_DIR / save_name
 
     try:
-        file.save(save_path)
+        save_stream(file.stream, save_path)
     except Exception as e:
         logger.info("replace save failed: %s", e)
         return jsonify({"error": "could not save uploaded file"}), 500
 
-    thumb_name = f"{save_name}.jpg"
-    thumb_path = THUMBS_DIR / thumb_name
-    thumb_created = generate_thumbnail(save_path, thumb_path)
-    thumbnail_url = f"/static/videos/thumbnails/{thumb_name}" if thumb_created else None
-    video_url = f"/static/videos/{save_name}"
+    return _finish_replace_video(
+        routine_id, r, filename, save_name, save_path,
+        title=request.form.get("title"), description=request.form.get("description"),
+    )
 
-    new_title = (request.form.get("title") or r.get("title") or filename).strip()
-    new_desc = (request.form.get("description") or r.get("description") or "").strip()
-    try:
-        db.execute(
-            "UPDATE routines SET title=?, video_url=?, thumbnail_url=?, description=? WHERE id=?",
-            (new_title, video_url, thumbnail_url, new_desc, routine_id),
-        )
-        db.commit()
-    except Exception as e:
-        logger.info("db update error: %s", e)
-        return jsonify({"error": "could not update DB"}), 500
+
+@app.route("/api/admin/replace_video_stream", methods=["POST", "PUT"])
+def api_admin_replace_video_stream():
+    """
+    Replace a routine's video from a raw request body (no multipart parsing).
+    Query args: routine_id (required), filename (required), title, description.
+    The body is copied to disk in UPLOAD_COPY_BUFFER chunks so memory stays flat for large files.
+    """
+    admin = require_admin()
+    routine_id = request.args.get("routine_id")
+    filename = safe_filename(request.args.get("filename") or "")
+    if not routine_id or not filename:
+        return jsonify({"error": "routine_id and filename required"}), 400
+
+    r = get_read_db().execute(SQL_SELECT_ROUTINE_TEXT, (routine_id,)).fetchone()
+    if not r:
+        return jsonify({"error": "routine not found"}), 404
+
+    head = read_head(request.stream)
+    if not looks_like_video(head):
+        return jsonify({"error": "unsupported file type"}), 415
+
+    stamp = time.time_ns()
+    rnd = secrets.token_hex(6)
+    save_name = f"{stamp}_{rnd}_{filename}"
+    save_path = VIDEOS_DIR / save_name
 
     try:
-        if old_video:
-            old_video_path = BASE_DIR / old_video.lstrip("/")
-            if old_video_path.exists():
-                old_video_path.unlink()
-        if old_thumb:
-            old_thumb_path = BASE_DIR / old_thumb.lstrip("/")
-            if old_thumb_path.exists():
-                old_thumb_path.unlink()
+        save_stream(request.stream, save_path, head=head)
     except Exception as e:
-        logger.info("old-file deletion failed: %s", e)
+        logger.info("replace stream save failed: %s", e)
+        return jsonify({"error": "could not save uploaded file"}), 500
 
-    try:
-        push_to_git(paths=None, message=f"replaced video for routine {routine_id}", include_media=True)
-    except Exception:
-        logger.exception("git push failed after replace_video")
+    return _finish_replace_video(
+        routine_id, r, filename, save_name, save_path,
+        title=request.args.get("title"), description=request.args.get("description"),
+    )
 
-    return jsonify({"ok": True, "video_url": video_url, "thumbnail_url": thumbnail_url})
+
+# one statement, one row: the column aliases are the JSON keys the dashboard reads;
+# the sums come from the trigger-maintained counters table instead of table scans
+SQL_ADMIN_METRICS = """
+SELECT
+    (SELECT COUNT(1) FROM users) AS total_users,
+    (SELECT v FROM counters WHERE k = 'visits_total') AS total_visits,
+    (SELECT COUNT(1) FROM routines) AS total_videos,
+    (SELECT v FROM counters WHERE k = 'views_total') AS total_plays,
+    (SELECT COUNT(1) FROM users WHERE reminders_set = 1) AS reminders_set
+"""
+
+# metrics don't need to be real-time; serve a cached copy for a few seconds. Admin writes
+# and new registrations drop it; play/visit counters just age out with the TTL.
+METRICS_TTL = 5
+_metrics_cache = {"t": 0.0, "v": None}
+
+
+def invalidate_metrics_cache():
+    _metrics_cache["t"] = 0.0
 
 
 @app.route("/api/admin/metrics")
 def api_admin_metrics():
     admin = require_admin()
-    db = get_db()
-    cur = db.execute("SELECT COUNT(1) AS total_users FROM users")
-    total_users = cur.fetchone()["total_users"]
-    cur = db.execute("SELECT SUM(visits) AS total_visits FROM users")
-    total_visits = db.execute("SELECT SUM(visits) AS total_visits FROM users").fetchone()["total_visits"] or 0
-    cur = db.execute("SELECT COUNT(1) AS total_videos FROM routines")
-    total_videos = cur.fetchone()["total_videos"]
-    cur = db.execute("SELECT SUM(views) AS total_plays FROM routines")
-    total_plays = cur.fetchone()["total_plays"] or 0
-    cur = db.execute("SELECT COUNT(1) AS reminders FROM users WHERE reminders_set = 1")
-    reminders = cur.fetchone()["reminders"]
-
-    return jsonify(
-        {
-            "total_users": total_users,
-            "total_visits": total_visits,
-            "total_videos": total_videos,
-            "total_plays": total_plays,
-            "reminders_set": reminders,
-        }
-    )
+    if _metrics_cache["v"] is not None and time.monotonic() - _metrics_cache["t"] < METRICS_TTL:
+        return jsonify(_metrics_cache["v"])
+
+    db = get_read_db()
+    metrics = dict(db.execute(SQL_ADMIN_METRICS).fetchone())
+    _metrics_cache["v"] = metrics
+    _metrics_cache["t"] = time.monotonic()
+    return jsonify(metrics)
 
 
 @app.route("/api/admin/promote", methods=["POST"])
@@ -1057,15 +2170,14 @@ def api_admin_promote():
     user_id = data.get("user_id")
     if not user_id:
         return jsonify({"error": "user_id required"}), 400
-    db = get_db()
     new_key = secrets.token_urlsafe(28)
-    db.execute("UPDATE users SET admin = 1, api_key = ? WHERE id = ?", (new_key, user_id))
-    db.commit()
+    with write_db() as db:
+        db.execute("UPDATE users SET admin = 1, api_key = ? WHERE id = ?", (new_key, user_id))
+    # the promoted user's old api key must stop working right away
+    invalidate_admin_cache()
+    invalidate_metrics_cache()
 
-    try:
-        push_to_git(paths=None, message=f"promote user {user_id} to admin", include_media=False)
-    except Exception:
-        logger.exception("git push failed after promote")
+    _git_queue.put((f"promote user {user_id} to admin", False))
 
     return jsonify({"ok": True, "new_admin_key": new_key})
 
@@ -1091,16 +2203,17 @@ def pulse_receiver():
     payload = request.get_json(silent=True)
     if payload is None:
         try:
-            payload = request.form.to_dict() or {"message": "pulse"}
+            payload = request.form.to_dict() or None
         except Exception:
-            payload = {"message": "pulse"}
+            payload = None
 
     # write a tiny heartbeat log (best-effort)
     try:
-        hb_file = SNAPSHOT_DIR / "heartbeats.log"
-        hb_line = f"{datetime.utcnow().isoformat()} {request.remote_addr} {json.dumps(payload, default=str)}\n"
-        with hb_file.open("a", encoding="utf-8") as f:
-            f.write(hb_line)
+        if payload is None or payload == EMPTY_PULSE:
+            body = EMPTY_PULSE_JSON
+        else:
+            body = heartbeat_json(payload)
+        write_heartbeat(f"{datetime.utcnow().isoformat()} {request.remote_addr} {body}\n")
     except Exception as e:
         logger.info("pulse_receiver: could not write heartbeat log: %s", e)
 
@@ -1123,7 +2236,7 @@ def api_admin_git_push():
     data = request.get_json(silent=True) or request.form or {}
     inc = str(data.get("include_media", "")).lower()
     include_media = inc in ("1", "true", "yes", "on")
-    message = data.get("message") or f"manual push by admin {admin.get('username', admin.get('id'))} at {datetime.utcnow().isoformat()}"
+    message = data.get("message") or f"manual push by admin {admin['display']} at {datetime.utcnow().isoformat()}"
 
     details = {}
     try:
@@ -1131,32 +2244,31 @@ def api_admin_git_push():
         details["git_repo_present_before"] = git_repo_present()
 
         # Try to push using the app helper
-        pushed = push_to_git(paths=None, message=message, include_media=include_media)
+        pushed = push_to_git(paths=None, message=message, include_media=include_media, full_snapshot=True)
         details["push_result"] = bool(pushed)
 
         # Gather some git diagnostics to return
         rc, out, err = run_git_cmd(["status", "--porcelain"])
         details["status_porcelain_rc"] = rc
-        details["status_porcelain_out"] = out if out else None
-        details["status_porcelain_err"] = err if err else None
+        details["status_porcelain_out"] = git_text(out) or None
+        details["status_porcelain_err"] = git_text(err) or None
 
         rc, out, err = run_git_cmd(["remote", "get-url", GITHUB_REMOTE_NAME])
         details["remote_get_url_rc"] = rc
-        details["remote_get_url_out"] = out if out else None
-        details["remote_get_url_err"] = err if err else None
+        details["remote_get_url_out"] = git_text(out) or None
+        details["remote_get_url_err"] = git_text(err) or None
 
         rc, out, err = run_git_cmd(["log", "-1", "--pretty=format:%H %s"]) 
         details["last_commit_rc"] = rc
-        details["last_commit_out"] = out if out else None
-        details["last_commit_err"] = err if err else None
+        details["last_commit_out"] = git_text(out) or None
+        details["last_commit_err"] = git_text(err) or None
 
         # tail the snapshot dir heartbeat and snapshot files if present
         try:
-            hb_file = SNAPSHOT_DIR / "heartbeats.log"
+            hb_file = HEARTBEAT_LOG
+            flush_heartbeats()
             if hb_file.exists():
-                with hb_file.open("r", encoding="utf-8") as f:
-                    lines = f.readlines()[-10:]
-                details["heartbeats_tail"] = [l.strip() for l in lines]
+                details["heartbeats_tail"] = [l.strip() for l in tail_lines(hb_file, 10)]
             else:
                 details["heartbeats_tail"] = None
         except Exception as e:
@@ -1170,4 +2282,5 @@ def api_admin_git_push():
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    # development server only; production runs `gunicorn -c gunicorn_conf.py app:app`
+    app.run(debug=os.environ.get("FLASK_DEBUG", "1") == "1")
@@ -0,0 +1,65 @@
+BEGIN TRANSACTION;
+CREATE TABLE counters (k TEXT PRIMARY KEY, v INTEGER NOT NULL DEFAULT 0);
+INSERT INTO "counters" VALUES('visits_total',0);
+INSERT INTO "counters" VALUES('views_total',0);
+CREATE TABLE plays (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            routine_id INTEGER,
+            played_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+CREATE TABLE routines (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT,
+            category TEXT,
+            difficulty TEXT,
+            duration INTEGER,
+            video_url TEXT,
+            thumbnail_url TEXT,
+            description TEXT,
+            uploaded_by INTEGER,
+            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            views INTEGER DEFAULT 0
+        );
+ANALYZE "sqlite_master";
+INSERT INTO "sqlite_stat1" VALUES('counters','sqlite_autoindex_counters_1','2 1');
+CREATE TABLE users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            age INTEGER,
+            country TEXT NOT NULL,
+            occupation TEXT,
+            admin INTEGER DEFAULT 0,
+            api_key TEXT,
+            visits INTEGER DEFAULT 0,
+            reminders_set INTEGER DEFAULT 0,
+            last_seen TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, password_hash TEXT,
+            UNIQUE(username, country)
+        );
+CREATE TRIGGER trg_users_visits_ins AFTER INSERT ON users BEGIN
+                UPDATE counters SET v = v + COALESCE(NEW.visits, 0) WHERE k = 'visits_total';
+            END;
+CREATE TRIGGER trg_users_visits_upd AFTER UPDATE OF visits ON users BEGIN
+                UPDATE counters SET v = v + COALESCE(NEW.visits, 0) - COALESCE(OLD.visits, 0) WHERE k = 'visits_total';
+            END;
+CREATE TRIGGER trg_users_visits_del AFTER DELETE ON users BEGIN
+                UPDATE counters SET v = v - COALESCE(OLD.visits, 0) WHERE k = 'visits_total';
+            END;
+CREATE TRIGGER trg_routines_views_ins AFTER INSERT ON routines BEGIN
+                UPDATE counters SET v = v + COALESCE(NEW.views, 0) WHERE k = 'views_total';
+            END;
+CREATE TRIGGER trg_routines_views_upd AFTER UPDATE OF views ON routines BEGIN
+                UPDATE counters SET v = v + COALESCE(NEW.views, 0) - COALESCE(OLD.views, 0) WHERE k = 'views_total';
+            END;
+CREATE TRIGGER trg_routines_views_del AFTER DELETE ON routines BEGIN
+                UPDATE counters SET v = v - COALESCE(OLD.views, 0) WHERE k = 'views_total';
+            END;
+CREATE INDEX idx_routines_uploaded_at ON routines(uploaded_at DESC);
+CREATE INDEX idx_plays_user_routine ON plays(user_id, routine_id);
+CREATE INDEX idx_plays_routine ON plays(routine_id);
+CREATE INDEX idx_users_admin ON users(admin) WHERE admin = 1;
+CREATE INDEX idx_users_apikey ON users(api_key) WHERE api_key IS NOT NULL;
+CREATE INDEX idx_users_reminders_set ON users(reminders_set) WHERE reminders_set = 1;
+DELETE FROM "sqlite_sequence";
+COMMIT;
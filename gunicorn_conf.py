@@ -0,0 +1,21 @@
+# gunicorn_conf.py — production server settings
+# Run with: gunicorn -c gunicorn_conf.py app:app
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", max(2, os.cpu_count() or 1)))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+# import app once in the master (init_db runs once; code pages shared copy-on-write)
+preload_app = True
+# uploads + thumbnailing can take a while
+timeout = 120
+
+
+def post_fork(server, worker):
+    # the app module was imported before fork: give each worker its own
+    # writer connection, executors and background threads
+    import app as app_module
+
+    app_module.init_worker_process()